@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Benchmark of the websocket fileserver with many clients at once.
+
+Writes a fake run, plus many other runs to make directory listings slow,
+starts ``scripts/fileserver`` on it, and then has increasing numbers of
+clients fetch random frames while other clients list the directory.
+Because file access happens off the IOLoop, throughput should rise with
+the number of clients, and frame latency should not be held up by listings.
+
+    python benchmarks/bench_fileserver_concurrency.py --clients 1 4 16
+"""
+from __future__ import print_function, division
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+from tornado import gen, ioloop, websocket, httpclient
+
+PORT = 8007
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'fileserver')
+
+
+def make_run(path, nframes, nx, ny):
+    """
+    Write a fake run of 5 CCDs x 4 quadrants, each with one nx x ny window.
+    """
+    hdr = fits.Header()
+    hdr['SIMPLE'] = True
+    hdr['BITPIX'] = 16
+    hdr['NAXIS'] = 0
+    hdr['HIERARCH ESO DET READ CURID'] = 2
+    hdr['HIERARCH ESO DET WIN1 NX'] = nx
+    hdr['HIERARCH ESO DET WIN1 NY'] = ny
+    hdr['HIERARCH ESO DET ACQ1 WIN NX'] = 20 * nx
+    hdr['HIERARCH ESO DET ACQ1 WIN NY'] = ny
+    frame = np.random.randint(-32768, 32767, 20*nx*ny + 18).astype('>i2').tobytes()
+    with open(path, 'wb') as fileobj:
+        fileobj.write(hdr.tostring().encode())
+        for i in range(nframes):
+            fileobj.write(frame)
+
+
+@gen.coroutine
+def frame_client(nframes, nrequests, latencies):
+    ws = yield websocket.websocket_connect('ws://localhost:{}/run0001'.format(PORT))
+    yield ws.read_message()
+    for i in range(nrequests):
+        start = time.time()
+        ws.write_message(json.dumps({'action': 'get_frame',
+                                     'frame_number': random.randint(1, nframes)}))
+        yield ws.read_message()
+        latencies.append(time.time() - start)
+    ws.close()
+
+
+@gen.coroutine
+def dir_client(stop):
+    client = httpclient.AsyncHTTPClient()
+    while not stop:
+        yield client.fetch('http://localhost:{}/?action=dir'.format(PORT))
+
+
+@gen.coroutine
+def run_clients(nclients, nlisters, nframes, nrequests):
+    latencies = []
+    stop = []
+    listers = [dir_client(stop) for i in range(nlisters)]
+    start = time.time()
+    yield [frame_client(nframes, nrequests, latencies) for i in range(nclients)]
+    elapsed = time.time() - start
+    stop.append(True)
+    yield listers
+    raise gen.Return((elapsed, np.array(latencies)))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16],
+                        help="numbers of frame clients to try")
+    parser.add_argument('--listers', type=int, default=2, help="clients listing directory")
+    parser.add_argument('--nruns', type=int, default=5000, help="extra runs in directory")
+    parser.add_argument('--nframes', type=int, default=200, help="frames in run")
+    parser.add_argument('--requests', type=int, default=50, help="frames fetched per client")
+    parser.add_argument('--size', type=int, default=100, help="window size in pixels")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    server = None
+    try:
+        make_run(os.path.join(directory, 'run0001.fits'), args.nframes, args.size, args.size)
+        for i in range(args.nruns):
+            open(os.path.join(directory, 'run{:05d}.fits'.format(i + 2)), 'w').close()
+        server = subprocess.Popen([sys.executable, SCRIPT, '--dir', directory],
+                                  stdout=open(os.devnull, 'w'))
+        time.sleep(2)
+
+        print('{:>8s} {:>12s} {:>12s} {:>12s}'.format('clients', 'frames/s', 'median ms', '95% ms'))
+        for nclients in args.clients:
+            elapsed, latencies = ioloop.IOLoop.current().run_sync(
+                lambda: run_clients(nclients, args.listers, args.nframes, args.requests))
+            print('{:8d} {:12.1f} {:12.2f} {:12.2f}'.format(
+                nclients, len(latencies) / elapsed,
+                1000 * np.median(latencies), 1000 * np.percentile(latencies, 95)))
+    finally:
+        if server is not None:
+            server.terminate()
+        shutil.rmtree(directory)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of MeCom frame checksums.
+
+Compares the pure python CRCCalculator with the bytes-based crc16, for a
+typical parameter read frame and for a long frame.
+
+    python benchmarks/bench_mecom_crc.py
+"""
+from __future__ import print_function, division
+import timeit
+
+from hcam_drivers.hardware.meerstetter import CRCCalculator, crc16, build_frame, parse_frame
+
+
+def run(label, func, number):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print('{:<40s} {:8.2f} us/call'.format(label, 1e6 * best / number))
+
+
+if __name__ == "__main__":
+    calc = CRCCalculator()
+    short_msg = '#0103E8?VR03E801'
+    long_msg = short_msg * 64
+    short_bytes = short_msg.encode()
+    long_bytes = long_msg.encode()
+    frame = build_frame(1, 1000, '?VR03E801')[:-1]
+
+    assert calc(short_msg) == '{:04X}'.format(crc16(short_msg))
+    assert calc(long_msg) == '{:04X}'.format(crc16(long_msg))
+
+    run('CRCCalculator, {} bytes'.format(len(short_msg)), lambda: calc(short_msg), 20000)
+    run('crc16, {} bytes'.format(len(short_msg)), lambda: crc16(short_bytes), 20000)
+    run('CRCCalculator, {} bytes'.format(len(long_msg)), lambda: calc(long_msg), 2000)
+    run('crc16, {} bytes'.format(len(long_msg)), lambda: crc16(long_bytes), 2000)
+    run('build_frame', lambda: build_frame(1, 1000, b'?VR03E801'), 20000)
+    run('parse_frame', lambda: parse_frame(frame), 20000)
@@ -10,20 +10,20 @@
 from __future__ import print_function, unicode_literals, absolute_import, division
 import six
 import numpy as np
-import threading
 import time
 
 from hcam_widgets import widgets as w
 from hcam_widgets.tkutils import get_root, addStyle
 from . import honeywell, meerstetter, unichiller, vacuum, rack
 from ..utils.alarms import AlarmDialog
+from ..utils.poller import get_poller
+from ..utils import telemetry
+from ..utils.telemetry_store import TelemetryStore
 
 if not six.PY3:
     import Tkinter as tk
-    from Queue import Queue, Empty
 else:
     import tkinter as tk
-    from queue import Queue, Empty
 
 
 class NoAlarmState(object):
@@ -120,8 +120,8 @@ class HardwareDisplayWidget(tk.Frame):
     A widget that displays and checks the status of a piece of hardware.
 
     Consists of a label naming the piece of hardware, and an Ilabel to display the results of
-    the hardware check. Checks itself repeatedly in the background using a thread so as
-    not to hang the GUI main thread.
+    the hardware check. Checks itself repeatedly in the background using the application's
+    `~hcam_drivers.utils.poller.HardwarePoller` so as not to hang the GUI main thread.
 
     Each HardwareDisplayWidget has its own status (ok/nok) and an alarm state which can
     be NoAlarm, ActiveAlarm, AcknowledgedAlarm.
@@ -150,7 +150,6 @@ class HardwareDisplayWidget(tk.Frame):
         self.kind = kind
         self.update_interval = int(update_interval*1000)
         self.ok = True
-        self.queue = Queue()
         self.fmt = '{:.1f}'
         self.upper_limit = upper_limit
         self.lower_limit = lower_limit
@@ -161,53 +160,87 @@ class HardwareDisplayWidget(tk.Frame):
 
         self.after(self.update_interval, self.start_update)
 
-    def process_update(self):
+    @property
+    def cache_key(self):
         """
-        Try and get the result of hardware update from the queue. If it's not ready yet,
-        reschedule this check for 200ms later.
+        The (device, channel, quantity) key of this widget's value in the telemetry cache.
         """
-        try:
-            val, errmsg = self.queue.get(block=False)
-            g = get_root(self.parent).globals
-            if errmsg is not None:
-                g.clog.warn('Could not update {} for {}: {}'.format(self.kind, self.name, errmsg))
+        return None
 
-            self.label.configure(text=self.fmt.format(val), bg=g.COL['main'])
+    @property
+    def device_id(self):
+        """
+        Identifies the physical device this widget reads from.
 
-            if errmsg is None and val <= self.upper_limit and val >= self.lower_limit:
-                self.ok = True
-            elif np.isnan(val) and errmsg is None:
-                # no error and nan returned means checking disabled
-                self.ok = True
-            else:
-                self.ok = False
+        Reads for widgets with the same device_id are grouped together by the poller.
+        """
+        if self.cache_key is None:
+            return id(self)
+        return self.cache_key[0]
 
-            if not self.ok:
-                self.label.configure(bg=g.COL['warn'])
+    @property
+    def poll_key(self):
+        """
+        Identifies the value read by this widget, so the poller makes a single read
+        for all widgets showing the same quantity of the same physical device.
+        """
+        if self.cache_key is None:
+            return (id(self), self.kind, self.name)
+        return self.cache_key
 
-            self.after(self.update_interval, self.start_update)
-        except Empty:
-            self.after(200, self.process_update)
+    @property
+    def reading(self):
+        """
+        Latest `~hcam_drivers.utils.telemetry.Reading` of this widget's value, or None
+        """
+        if self.cache_key is None:
+            return None
+        return telemetry.cache.get(*self.cache_key)
 
-    def start_update(self):
+    def fetch(self, function):
         """
-        Start a thread to check hardware, and schedule a later check to see if it's done.
+        Return value from the telemetry cache, calling function to read the hardware if needed.
+
+        The hardware is only read if no-one else has read this quantity within the
+        last half update interval.
         """
-        t = threading.Thread(target=self.update)
-        t.start()
-        self.after(200, self.process_update)
+        device, channel, quantity = self.cache_key
+        max_age = self.update_interval / 2000
+        return telemetry.cache.fetch(device, channel, quantity, function, max_age).value
 
-    def update(self):
+    def process_update(self, val, err):
         """
-        Simple wrapper to call update function and put the return value and any error message into queue.
+        Display the result of a hardware update, and schedule the next one.
         """
+        g = get_root(self.parent).globals
         errmsg = None
-        try:
-            val = self.update_function()
-        except Exception as err:
+        if err is not None:
             errmsg = str(err)
             val = np.nan
-        self.queue.put((val, errmsg))
+            g.clog.warn('Could not update {} for {}: {}'.format(self.kind, self.name, errmsg))
+
+        self.label.configure(text=self.fmt.format(val), bg=g.COL['main'])
+
+        if errmsg is None and val <= self.upper_limit and val >= self.lower_limit:
+            self.ok = True
+        elif np.isnan(val) and errmsg is None:
+            # no error and nan returned means checking disabled
+            self.ok = True
+        else:
+            self.ok = False
+
+        if not self.ok:
+            self.label.configure(bg=g.COL['warn'])
+
+        self.after(self.update_interval, self.start_update)
+
+    def start_update(self):
+        """
+        Ask the hardware poller to check hardware. process_update is called with the result.
+        """
+        root = get_root(self.parent)
+        poller = get_poller(root.globals, root)
+        poller.request(self.device_id, self.poll_key, self.update_function, self.process_update)
 
     def update_function(self):
         raise NotImplementedError('concrete class must implement update_function')
@@ -229,29 +262,44 @@ class MeerstetterWidget(HardwareDisplayWidget):
     """
     Get CCD info from Meerstetters
     """
-    def __init__(self, parent, ms, address, name, kind, update_interval, lower_limit, upper_limit):
+    quantities = {
+        'status': 'status_ok',
+        'temperature': 'ccd_temp',
+        'heatsink temperature': 'heatsink_temp',
+        'peltier power': 'peltier_power'
+    }
+
+    def __init__(self, parent, ms, address, name, kind, update_interval, lower_limit, upper_limit,
+                 poll_addresses=None):
+        """
+        poll_addresses lists all TEC addresses on the meerstetter. They are all read in
+        one burst, so the other widgets for this meerstetter can use the cached values.
+        """
         HardwareDisplayWidget.__init__(self, parent, kind, name, update_interval, lower_limit, upper_limit)
+        if kind not in self.quantities:
+            raise ValueError('unknown kind: {}'.format(kind))
         self.ms = ms
         self.address = address
+        self.poll_addresses = poll_addresses if poll_addresses is not None else (address,)
         if kind == 'peltier power':
             self.fmt = '{:.0f}'
         elif kind == 'status':
             self.fmt = BoolFormatter()
 
+    @property
+    def cache_key(self):
+        return (self.ms.device_id, self.address, self.quantities[self.kind])
+
+    def poll(self):
+        results, errors = self.ms.poll_tecs(self.poll_addresses)
+        if self.address in errors:
+            raise errors[self.address]
+        return telemetry.cache.get(*self.cache_key).value
+
     def update_function(self):
         g = get_root(self.parent).globals
         if g.cpars['ccd_temp_monitoring_on']:
-            if self.kind == 'status':
-                ok, code = self.ms.get_status(self.address)
-                return int(ok)
-            if self.kind == 'temperature':
-                return self.ms.get_ccd_temp(self.address).value
-            elif self.kind == 'heatsink temperature':
-                return self.ms.get_heatsink_temp(self.address).value
-            elif self.kind == 'peltier power':
-                return 100 * self.ms.get_current(self.address) / self.ms.tec_current_limit
-            else:
-                raise ValueError('unknown kind: {}'.format(self.kind))
+            return self.fetch(self.poll)
         else:
             return np.nan
 
@@ -265,10 +313,14 @@ class ChillerWidget(HardwareDisplayWidget):
                                        update_interval, lower_limit, upper_limit)
         self.chiller = chiller
 
+    @property
+    def cache_key(self):
+        return (self.chiller.device_id, None, 'temperature')
+
     def update_function(self):
         g = get_root(self.parent).globals
         if g.cpars['chiller_temp_monitoring_on']:
-            return self.chiller.temperature
+            return self.fetch(lambda: self.chiller.temperature)
         else:
             return np.nan
 
@@ -282,10 +334,14 @@ class RackSensorWidget(HardwareDisplayWidget):
                                        update_interval, lower_limit, upper_limit)
         self.rack_sensor = rack_sensor
 
+    @property
+    def cache_key(self):
+        return (self.rack_sensor.device_id, None, 'temperature')
+
     def update_function(self):
         g = get_root(self.parent).globals
         if g.cpars['chiller_temp_monitoring_on']:
-            return self.rack_sensor.temperature
+            return self.fetch(lambda: self.rack_sensor.temperature)
         else:
             return np.nan
 
@@ -301,10 +357,14 @@ class FlowRateWidget(HardwareDisplayWidget):
         self.pen_address = pen_address
         self.fmt = '{:.2f}'
 
+    @property
+    def cache_key(self):
+        return (self.honey.device_id, self.pen_address, 'flow_rate')
+
     def update_function(self):
         g = get_root(self.parent).globals
         if g.cpars['flow_monitoring_on']:
-            return self.honey.read_pen(self.pen_address)
+            return self.fetch(lambda: self.honey.read_pen(self.pen_address))
         else:
             return np.nan
 
@@ -312,17 +372,36 @@ class FlowRateWidget(HardwareDisplayWidget):
 class VacuumWidget(HardwareDisplayWidget):
     """
     Vacuum pressure from gauge
+
+    All gauges in the group are read together, so the other vacuum widgets
+    can use the result of the same sweep.
     """
-    def __init__(self, parent, gauge, name, update_interval, lower_limit, upper_limit):
+    def __init__(self, parent, group, index, name, update_interval, lower_limit, upper_limit):
         HardwareDisplayWidget.__init__(self, parent, 'pressure', name, update_interval,
                                        lower_limit, upper_limit)
-        self.gauge = gauge
+        self.group = group
+        self.index = index
+        self.gauge = group.gauges[index]
         self.fmt = '{:.2E}'
 
+    @property
+    def cache_key(self):
+        return (self.gauge.device_id, None, 'pressure')
+
+    @property
+    def device_id(self):
+        return self.group.device_id
+
+    def poll(self):
+        pressures, errors = self.group.read_pressures(max_age=self.update_interval / 2000)
+        if self.index in errors:
+            raise errors[self.index]
+        return 1000*pressures[self.index].value
+
     def update_function(self):
         g = get_root(self.parent).globals
         if g.cpars['ccd_vac_monitoring_on']:
-            return 1000*self.gauge.pressure.value
+            return self.fetch(self.poll)
         else:
             return np.nan
 
@@ -360,6 +439,7 @@ class CCDInfoWidget(tk.Toplevel):
             vacuum.PDR900(g.cpars['termserver_ip'], port) for port in
             g.cpars['vacuum_ports']
         ]
+        self.vacuum_group = vacuum.PDR900Group(self.vacuum_gauges)
         if g.cpars['telins_name'].lower() == 'wht':
             self.chiller = unichiller.UnichillerMPC(g.cpars['termserver_ip'],
                                                     g.cpars['chiller_port'])
@@ -374,6 +454,13 @@ class CCDInfoWidget(tk.Toplevel):
         self.flow_frm = tk.LabelFrame(self, text='Flow Rates (l/min)', padx=4, pady=4)
         self.vac_frm = tk.LabelFrame(self, text='Vacuums (mbar)', padx=4, pady=4)
 
+        # history of readings, kept in memory and archived to disk
+        try:
+            self.history = TelemetryStore(directory=g.cpars['hw_archive_directory'])
+        except Exception as err:
+            g.clog.warn('Cannot archive hardware readings: ' + str(err))
+            self.history = TelemetryStore()
+
         # variables to store hardware widgets
         update_interval = 20
         self.ms_status = []
@@ -398,6 +485,7 @@ class CCDInfoWidget(tk.Toplevel):
         ms2 = self.meerstetters[1]
         mapping = {1: (ms1, 1), 2: (ms1, 2), 3: (ms1, 3),
                    4: (ms2, 1), 5: (ms2, 2)}
+        poll_addresses = {ms1: (1, 2, 3), ms2: (1, 2)}
         # populate CCD frames
         for iccd in range(5):
             ms, address = mapping[iccd+1]
@@ -405,25 +493,29 @@ class CCDInfoWidget(tk.Toplevel):
             # meerstetter widgets
             self.ms_status.append(
                 MeerstetterWidget(self.status_frm, ms, address, name,
-                                  'status', update_interval, 0.5, 1.5)  # ok is 1, which is between 0.5 and 1.5
+                                  'status', update_interval, 0.5, 1.5,  # ok is 1, which is between 0.5 and 1.5
+                                  poll_addresses=poll_addresses[ms])
             )
             self.ccd_temps.append(
                 MeerstetterWidget(self.temp_frm, ms, address, name,
                                   'temperature', update_interval,
                                   g.cpars['ccd_temp_lower'],
-                                  g.cpars['ccd_temp_upper'])
+                                  g.cpars['ccd_temp_upper'],
+                                  poll_addresses=poll_addresses[ms])
             )
             self.heatsink_temps.append(
                 MeerstetterWidget(self.heatsink_frm, ms, address, name,
                                   'heatsink temperature', update_interval,
                                   g.cpars['ccd_sink_temp_lower'],
-                                  g.cpars['ccd_sink_temp_upper'])
+                                  g.cpars['ccd_sink_temp_upper'],
+                                  poll_addresses=poll_addresses[ms])
             )
             self.peltier_powers.append(
                 MeerstetterWidget(self.peltier_frm, ms, address, name,
                                   'peltier power', update_interval,
                                   g.cpars['ccd_peltier_lower'],
-                                  g.cpars['ccd_peltier_upper'])
+                                  g.cpars['ccd_peltier_upper'],
+                                  poll_addresses=poll_addresses[ms])
             )
 
             # grid
@@ -452,10 +544,10 @@ class CCDInfoWidget(tk.Toplevel):
             )
 
         # vacuum gauges
-        for iccd, gauge in enumerate(self.vacuum_gauges):
+        for iccd in range(len(self.vacuum_gauges)):
             name = 'CCD {}'.format(iccd+1)
             self.vacuums.append(
-                VacuumWidget(self.vac_frm, gauge, name, update_interval, -1e6, 5e-3)
+                VacuumWidget(self.vac_frm, self.vacuum_group, iccd, name, update_interval, -1e6, 5e-3)
             )
             self.vacuums[-1].grid(
                     row=int(iccd/3), column=iccd % 3, padx=5, sticky=tk.W
@@ -474,12 +566,35 @@ class CCDInfoWidget(tk.Toplevel):
         self.vac_frm.grid(row=5, column=0, padx=4, pady=4, sticky=tk.W)
 
         self.after(10000, self.raise_if_nok)
+        self.after(1000*update_interval, self.record_history)
+        self.history_interval = 1000*update_interval
+
+    @property
+    def hardware_widgets(self):
+        widgets = [self.chiller_temp, self.ngc_flow_rate]
+        for widget_list in (self.ms_status, self.ccd_temps, self.heatsink_temps,
+                            self.peltier_powers, self.ccd_flow_rates, self.vacuums):
+            widgets.extend(widget_list)
+        return widgets
+
+    def record_history(self):
+        """
+        Add latest reading from each widget to the history store.
+        """
+        for widget in self.hardware_widgets:
+            reading = widget.reading
+            if reading is not None:
+                channel = '{}_{}'.format(widget.name, widget.kind).lower().replace(' ', '_')
+                self.history.record(channel, reading.value, reading.time)
+        self.history.flush()
+        self.after(self.history_interval, self.record_history)
 
     def _getVal(self, widg):
         """
-        Return value from widget if set, else return -99.
+        Return latest value read by widget from the telemetry cache if set, else return -99.
         """
-        return -99 if widg.label['text'].lower() == 'nan' else float(widg.label['text'])
+        reading = widg.reading
+        return -99 if reading is None or np.isnan(reading.value) else reading.value
 
     def dumpJSON(self):
         """
@@ -496,6 +611,7 @@ class CCDInfoWidget(tk.Toplevel):
             try:
                 (pos_ms, pos_mm, pos_px), msg = g.fpslide.slide.return_position()
                 data['fpslide'] = pos_px
+                self.history.record('fpslide_position', pos_px)
             except Exception as err:
                 g.clog.warn('Slide error: ' + str(err))
         return data
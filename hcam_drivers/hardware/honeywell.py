@@ -2,6 +2,8 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 from hcam_widgets import DriverError
 import six
+
+from ..utils import telemetry
 if not six.PY3:
     from pymodbus.constants import Endian
     from pymodbus.payload import BinaryPayloadDecoder
@@ -15,6 +17,7 @@ else:
 class Honeywell:
     def __init__(self, address, port):
         self.address = address
+        self.device_id = ('honeywell', address)
         self.client = ModbusClient(address, port=port)
         # list mapping pen ID number to address
         self.pen_addresses = dict(
@@ -49,6 +52,7 @@ class Honeywell:
             raise DriverError(str(err))
         finally:
             self.client.close()
+        telemetry.cache.put(self.device_id, pen_name, 'flow_rate', value)
         return value
 
     def get_pen(self, address):
@@ -1,13 +1,19 @@
 # Utility to query and set temps via Ethernet on Meerstetter
 from __future__ import absolute_import, unicode_literals, print_function, division
+import binascii
 import socket
 import random
 import six
 import struct
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
 
 from astropy import units as u
 
+from ..utils import telemetry
+from .session import TCPSession, SessionPool
+
 # GUI imports
 from hcam_widgets.widgets import RangedInt
 from hcam_widgets.tkutils import get_root, addStyle
@@ -30,6 +36,16 @@ error_codes = {
     '+08': 'Instance not available'
 }
 
+# parameters (instance 1) whose values are stored in the telemetry cache
+telemetry_quantities = {
+    104: 'status',
+    1000: 'ccd_temp',  # deg C
+    1001: 'heatsink_temp',  # deg C
+    1010: 'setpoint',  # deg C
+    1020: 'current',  # A
+    1021: 'voltage'  # V
+}
+
 
 def hex_to_int(hexstring):
     return int(hexstring, 16)
@@ -47,7 +63,107 @@ def float32_to_hex(f):
     return format(struct.unpack(str('<I'), struct.pack(str('<f'), f))[0], 'X')
 
 
+def crc16(msg):
+    """
+    CRC-CCITT (XModem) checksum of a MeCom message.
+
+    Uses `binascii.crc_hqx`, which processes the whole buffer in C, and gives the
+    same result as `CRCCalculator`.
+
+    Parameters
+    ----------
+    msg : bytes, bytearray, memoryview or str
+        message to checksum. Strings are encoded as ASCII.
+
+    Returns
+    -------
+    crc : int
+        16-bit checksum
+    """
+    if isinstance(msg, six.text_type):
+        msg = msg.encode('ascii')
+    elif isinstance(msg, memoryview):
+        # bytes(view) gives the repr of the view on python 2, not its contents
+        msg = msg.tobytes()
+    elif six.PY2:
+        msg = bytes(msg)
+    return binascii.crc_hqx(msg, 0)
+
+
+def crc16_hex(msg):
+    """
+    CRC of a MeCom message as 4 uppercase hex digits, encoded as bytes.
+    """
+    return '{:04X}'.format(crc16(msg)).encode('ascii')
+
+
+def build_frame(address, seq_no, payload, control=b'#'):
+    """
+    Assemble a MeCom frame as bytes.
+
+    Transmissions are sent in blocks of data known as frames. Each frame has
+    several fields:
+
+    1: Control (source); ASCII Char; 1 bytes
+    2: Address; UINT8; 2 bytes
+    3: Sequence No; UINT16; 4 bytes
+    4: Payload; N bytes
+    5: Checksum, 4 bytes
+    6: End of Frame, 1 byte <CR>
+
+    Parameters
+    ----------
+    address : int
+        device address
+    seq_no : int
+        sequence number
+    payload : bytes or str
+        frame payload
+    control : bytes
+        control character, '#' for frames sent by the host
+    """
+    if isinstance(payload, six.text_type):
+        payload = payload.encode('ascii')
+    msg = control + '{:02X}{:04X}'.format(address, seq_no).encode('ascii') + payload
+    return msg + crc16_hex(msg) + b'\r'
+
+
+def parse_frame(frame):
+    """
+    Split a received MeCom frame into its fields.
+
+    Parameters
+    ----------
+    frame : bytes, bytearray or memoryview
+        a frame, without the trailing <CR>
+
+    Returns
+    -------
+    control : bytes
+        control character
+    address : int
+        device address
+    seq_no : int
+        sequence number
+    payload : memoryview
+        the payload, as a view into frame
+    crc_ok : bool
+        True if the checksum of frame is correct
+    """
+    view = memoryview(frame)
+    control = view[0:1].tobytes()
+    address = int(view[1:3].tobytes(), 16)
+    seq_no = int(view[3:7].tobytes(), 16)
+    crc_ok = crc16_hex(view[:-4]) == view[-4:].tobytes()
+    return control, address, seq_no, view[7:-4], crc_ok
+
+
 class CRCCalculator(object):
+    """
+    Pure python, table-driven CRC-CCITT calculator.
+
+    Kept as a reference implementation; `crc16` is much faster.
+    """
     def __init__(self):
         self.polynomial = 0x1021
         self.preset = 0
@@ -90,6 +206,125 @@ def socketcontext(addr, port):
         s.close()
 
 
+class MeComSession(TCPSession):
+    """
+    A long-lived TCP session with a single TEC controller.
+
+    The socket is opened on first use and the welcome banner sent by the
+    LTR-1200 is consumed once per connection, rather than once per query.
+    Any communication error closes the socket, and the next request
+    reconnects automatically. Access is serialised with a lock, so a session
+    can be safely shared between the threads of the hardware widgets.
+
+    Sessions should normally be obtained with `get_session`, so that all
+    `MeerstetterTEC1090` objects talking to the same controller share one
+    connection. `health` reports the controller's IP address as 'address'.
+
+    Parameters
+    ----------
+    address : string
+        IP address of controller
+    port : int
+        port number of controller
+    timeout : float
+        socket timeout in seconds
+    """
+    def __init__(self, address, port, timeout=DEFAULT_TIMEOUT):
+        TCPSession.__init__(self, address, port, timeout)
+        self.address = address
+        self._buffer = b''
+
+    def _handshake(self, sock):
+        # wait for welcome banner
+        welcome = sock.recv(1024)
+        if b'Welcome' not in welcome:
+            raise IOError('did not receive welcome message from meerstetter')
+
+    def close(self):
+        with self.lock:
+            TCPSession.close(self)
+            self._buffer = b''
+
+    def send(self, frame_msg):
+        """
+        Send a frame, connecting first if needed.
+        """
+        if isinstance(frame_msg, six.text_type):
+            frame_msg = frame_msg.encode('ascii')
+        with self.lock:
+            if self._sock is None:
+                self.connect()
+            self._sock.sendall(frame_msg)
+
+    def recv_frame(self):
+        """
+        Read a single <CR> terminated frame from the controller.
+
+        The frame is returned as bytes, without the <CR>.
+        """
+        with self.lock:
+            while b'\r' not in self._buffer:
+                chunk = self._sock.recv(1024)
+                if not chunk:
+                    raise EOFError('connection closed by meerstetter')
+                self._buffer += chunk
+            frame, self._buffer = self._buffer.split(b'\r', 1)
+            return frame.strip()
+
+    def exchange(self, frame_msg):
+        """
+        Send one frame and return the response.
+
+        If the connection was already open and turns out to have been
+        closed by the controller, it is re-opened and the frame sent once more.
+        """
+        return self.exchange_many([frame_msg])[0]
+
+    def exchange_many(self, frame_msgs):
+        """
+        Send several frames in one burst, and read one response per frame.
+
+        The frames are written to the socket together, so the controller can
+        answer them back-to-back without waiting for a round trip between each.
+        Responses are returned in the order they arrive; it is up to the caller
+        to match them to requests using the sequence number.
+        """
+        burst = b''.join(frame_msg.encode('ascii') if isinstance(frame_msg, six.text_type)
+                         else frame_msg for frame_msg in frame_msgs)
+        with self.lock:
+            reused = self._sock is not None
+            try:
+                try:
+                    self.send(burst)
+                    ret_msgs = [self.recv_frame() for frame in frame_msgs]
+                except EOFError:
+                    if not reused:
+                        raise
+                    self.connect()
+                    self.send(burst)
+                    ret_msgs = [self.recv_frame() for frame in frame_msgs]
+            except Exception as err:
+                self.fail(err)
+                raise
+            self.succeed(len(frame_msgs))
+            return ret_msgs
+
+    def health(self):
+        health = TCPSession.health(self)
+        health['address'] = health.pop('host')
+        return health
+
+
+pool = SessionPool(MeComSession)
+
+
+def get_session(address, port):
+    """
+    Return the shared `MeComSession` for a controller, creating it if needed.
+    """
+    return pool.get(address, port)
+
+
 class MeerstetterTEC1090(object):
     """
     Class to use TCP/IP to communicate with TEC-1090 controllers
@@ -101,51 +336,44 @@ class MeerstetterTEC1090(object):
     def __init__(self, address, port):
         self.address = address
         self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.session = get_session(address, port)
+        self.device_id = ('meerstetter', address, port)
         self.seq_no = random.randint(1, 1000)
-        self.crc_calc = CRCCalculator()
         self.tec_current_limit = 10.7 * u.A
 
     def _assemble_frame(self, address, payload):
         """
-        Assemble the frame of data to send.
-
-        Transmissions are sent in blocks of data known as frames. Each frame has
-        several fields:
-
-        1: Control (source); ASCII Char; 1 bytes
-        2: Address; UINT8; 2 bytes
-        3: Sequence No; UINT16; 4 bytes
-        4: Payload; N bytes
-        5: Checksum, 4 bytes
-        6: End of Frame, 1 byte <CR>
+        Assemble the frame of data to send, as bytes. See `build_frame`.
         """
-        cs = '#'
-        addr = format(address, '0>2X')
-        seq = format(self.seq_no, '0>4X')
-        self.seq_no += 1
-        msg = cs + addr + seq + payload
-        eof = '\r'
-        return msg + self.crc_calc(msg) + eof
+        frame_msg = build_frame(address, self.seq_no, payload)
+        self.seq_no = (self.seq_no + 1) % 0x10000
+        return frame_msg
 
     def _send_frame(self, frame_msg):
-        with socketcontext(self.address, self.port) as s:
-            welcome = s.recv(1024)
-            if 'Welcome' not in welcome.decode():
-                raise IOError('did not receive welcome message from meerstetter')
-            s.send(frame_msg.encode())
-            ret_msg = s.recv(1024)
-        ret_msg = ret_msg.decode().strip()
+        ret_msg = self.session.exchange(frame_msg)
         self._check_response(frame_msg, ret_msg)
         return self._strip_response(ret_msg)
 
+    def health(self):
+        """
+        Health of the connection to this controller, see `MeComSession.health`.
+        """
+        return self.session.health()
+
+    def close(self):
+        self.session.close()
+
     def _check_response(self, frame_msg, ret_msg):
-        if ret_msg[0] == '!' and frame_msg[1:7] == ret_msg[1:7]:
+        try:
+            control, _, _, _, crc_ok = parse_frame(ret_msg)
+        except ValueError:
+            control = None
+        if control == b'!' and frame_msg[1:7] == ret_msg[1:7]:
             # a valid response, and same seq no. so far so good
             crc_back = ret_msg[-4:]
             crc_out = frame_msg[-5:-1]
-            package_in = ret_msg[:-4]
-            if self.crc_calc(package_in) != crc_back and crc_out != crc_back:
+            # some responses echo the checksum of the outgoing frame
+            if not crc_ok and crc_out != crc_back:
                 raise IOError('checksum of return message not OK:\nOut: {}\nBack: {}'.format(
                                 frame_msg, ret_msg
                               ))
@@ -155,22 +383,187 @@ class MeerstetterTEC1090(object):
                           ))
 
     def _strip_response(self, ret_msg):
-        return ret_msg[7:-4]
+        return ret_msg[7:-4].decode('ascii')
 
-    def get_param(self, address, param_no, instance, param_type='float'):
-        payload = '?VR{param_no:0>4X}{instance:0>2X}'.format(
-            param_no=param_no, instance=instance
-        )
-        frame_msg = self._assemble_frame(address, payload)
-        encoded_param_val = self._send_frame(frame_msg)
+    def _decode_param(self, encoded_param_val, param_no, param_type):
         if encoded_param_val == '+05':
             raise IOError('param {} not available'.format(param_no))
+        elif encoded_param_val.startswith('+'):
+            raise IOError(error_codes.get(encoded_param_val,
+                                          'unknown error code {}'.format(encoded_param_val)))
 
         if param_type == 'float':
             return hex_to_float32(encoded_param_val)
         else:
             return hex_to_int(encoded_param_val)
 
+    def _read_payload(self, param_no, instance):
+        return '?VR{param_no:0>4X}{instance:0>2X}'.format(
+            param_no=param_no, instance=instance
+        )
+
+    def get_param(self, address, param_no, instance, param_type='float'):
+        payload = self._read_payload(param_no, instance)
+        frame_msg = self._assemble_frame(address, payload)
+        encoded_param_val = self._send_frame(frame_msg)
+        value = self._decode_param(encoded_param_val, param_no, param_type)
+        self._record(address, param_no, instance, value)
+        return value
+
+    def _record(self, address, param_no, instance, value, timestamp=None):
+        """
+        Store parameter in the telemetry cache, if it is one we monitor.
+        """
+        if instance == 1 and param_no in telemetry_quantities:
+            telemetry.cache.put(self.device_id, address, telemetry_quantities[param_no],
+                                value, timestamp)
+
+    def _record_error(self, address, param_no, instance, error, timestamp=None):
+        """
+        Store a failed read in the telemetry cache, if it is a parameter we monitor.
+        """
+        if instance == 1 and param_no in telemetry_quantities:
+            telemetry.cache.put_error(self.device_id, address, telemetry_quantities[param_no],
+                                      error, timestamp)
+
+    def get_params(self, requests):
+        """
+        Read many parameters in a single burst over one connection.
+
+        All the request frames are sent together and the responses are matched
+        back to their requests by sequence number, so reading every parameter
+        for all the TECs on a controller costs one round trip, not one per value.
+        A parameter that cannot be read does not stop the others being returned.
+
+        For example::
+
+            >> ms.get_params([(1, 1000, 1, 'float'), (1, 104, 1, 'int'), (2, 1000, 1, 'float')])
+            ({(1, 1000, 1, 'float'): -90.1, (1, 104, 1, 'int'): 2},
+             {(2, 1000, 1, 'float'): IOError('Device is busy')})
+
+        Parameters
+        ----------
+        requests : iterable
+            sequence of (address, param_no, instance, param_type) tuples.
+            param_type is 'float' or 'int', and may be omitted for floats.
+
+        Returns
+        -------
+        values : dict
+            decoded parameter values, keyed by the request tuples
+        errors : dict
+            exception for each parameter that could not be read, e.g because
+            the TEC replied with an error code or a bad checksum, keyed by the
+            request tuples
+
+        Raises
+        ------
+        IOError
+            if communication with the controller fails
+        """
+        pending = OrderedDict()
+        for request in requests:
+            address, param_no, instance = request[:3]
+            param_type = request[3] if len(request) > 3 else 'float'
+            frame_msg = self._assemble_frame(address, self._read_payload(param_no, instance))
+            # sequence number is characters 3-7 of a frame
+            pending[frame_msg[3:7]] = (request, frame_msg, param_no, param_type)
+        if not pending:
+            return dict(), dict()
+
+        acquired = time.time()
+        try:
+            ret_msgs = self.session.exchange_many([item[1] for item in pending.values()])
+        except Exception as err:
+            for request, _, param_no, _ in pending.values():
+                self._record_error(request[0], param_no, request[2], err, acquired)
+            raise
+        values = dict()
+        errors = dict()
+        for ret_msg in ret_msgs:
+            try:
+                request, frame_msg, param_no, param_type = pending.pop(ret_msg[3:7])
+            except KeyError:
+                self.session.fail('unexpected sequence number in {!r}'.format(ret_msg))
+                raise IOError('response does not match any request: {}'.format(ret_msg))
+            try:
+                self._check_response(frame_msg, ret_msg)
+                encoded_param_val = self._strip_response(ret_msg)
+                values[request] = self._decode_param(encoded_param_val, param_no, param_type)
+            except (IOError, ValueError) as err:
+                errors[request] = err
+                self._record_error(request[0], param_no, request[2], err, acquired)
+                continue
+            self._record(request[0], param_no, request[2], values[request], acquired)
+        return values, errors
+
+    def poll_tecs(self, addresses):
+        """
+        Read temperatures, current and status of several TECs in one burst.
+
+        Parameters
+        ----------
+        addresses : iterable
+            addresses of TECs on this controller
+
+        Returns
+        -------
+        results : dict
+            for each address, a dictionary with keys 'ccd_temp', 'heatsink_temp',
+            'current' and 'status'. The values are as returned by `get_ccd_temp`,
+            `get_heatsink_temp`, `get_current` and `get_status`.
+
+            The peltier power (as a percentage of the current limit) and a 1/0
+            status flag are also stored in the telemetry cache, as 'peltier_power'
+            and 'status_ok'.
+        errors : dict
+            exception for each TEC that could not be read, keyed by address.
+            Other TECs on the controller are still read.
+
+        Raises
+        ------
+        IOError
+            if communication with the controller fails
+        """
+        requests = []
+        for address in addresses:
+            requests.extend([
+                (address, 1000, 1, 'float'),
+                (address, 1001, 1, 'float'),
+                (address, 1020, 1, 'float'),
+                (address, 104, 1, 'int')
+            ])
+        acquired = time.time()
+        try:
+            values, param_errors = self.get_params(requests)
+        except Exception as err:
+            for address in addresses:
+                self._record_derived_error(address, err, acquired)
+            raise
+        results = dict()
+        errors = dict()
+        for request, err in param_errors.items():
+            errors.setdefault(request[0], err)
+        for address in addresses:
+            if address in errors:
+                self._record_derived_error(address, errors[address], acquired)
+                continue
+            results[address] = dict(
+                ccd_temp=values[(address, 1000, 1, 'float')]*u.Celsius,
+                heatsink_temp=values[(address, 1001, 1, 'float')]*u.Celsius,
+                current=values[(address, 1020, 1, 'float')]*u.A,
+                status=self._decode_status(values[(address, 104, 1, 'int')])
+            )
+            peltier_power = 100 * (results[address]['current'] / self.tec_current_limit).decompose()
+            telemetry.cache.put(self.device_id, address, 'peltier_power', peltier_power.value)
+            telemetry.cache.put(self.device_id, address, 'status_ok', int(results[address]['status'][0]))
+        return results, errors
+
+    def _record_derived_error(self, address, error, timestamp):
+        # quantities poll_tecs works out from the parameters it reads
+        for quantity in ('peltier_power', 'status_ok'):
+            telemetry.cache.put_error(self.device_id, address, quantity, error, timestamp)
+
     def reset_tec(self, address):
         payload = 'RS'
         frame_msg = self._assemble_frame(address, payload)
@@ -215,6 +608,9 @@ class MeerstetterTEC1090(object):
     def get_status(self, address):
         param_no = 104
         status = self.get_param(address, param_no, 1, param_type='int')
+        return self._decode_status(status)
+
+    def _decode_status(self, status):
         lut = {0: 'init', 1: 'ready', 2: 'run', 3: 'error',
                4: 'bootloader', 5: 'resetting'}
         # return OK/NOK and status
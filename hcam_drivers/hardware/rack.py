@@ -1,15 +1,23 @@
 # module to talk to the arduino in the thermal enclosure
 from hcam_widgets.gtc.corba import get_telescope_server
 
+from ..utils import telemetry
+
 
 class GTCRackSensor(object):
 
+    device_id = ('gtc_rack',)
+
     @property
     def temperature(self):
         s = get_telescope_server()
-        return s.getCabinetTemperature1()
+        value = s.getCabinetTemperature1()
+        telemetry.cache.put(self.device_id, None, 'temperature', value)
+        return value
 
     @property
     def humidity(self):
         s = get_telescope_server()
-        return s.getHumidity()
+        value = s.getHumidity()
+        telemetry.cache.put(self.device_id, None, 'humidity', value)
+        return value
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Long-lived TCP sessions with hardware, shared by everything talking to the same device
+"""
+from __future__ import (print_function, unicode_literals, division, absolute_import)
+import socket
+import threading
+import time
+
+
+class TCPSession(object):
+    """
+    A long-lived TCP connection to one device.
+
+    The socket is opened by `connect` and kept open between requests, so
+    bursts of requests do not pay for a new connection each time. Subclasses
+    send requests over it, and call `fail` on communication errors, which
+    closes the socket so the next request reconnects. Access is serialised
+    with a lock, so a session can be shared between threads.
+
+    Sessions should normally be obtained from a `SessionPool`, so that all
+    objects talking to the same device share one connection.
+
+    Parameters
+    ----------
+    host : string
+        IP address of device
+    port : int
+        port number of device
+    timeout : float
+        socket timeout in seconds
+    """
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self._sock = None
+        self.n_connects = 0
+        self.n_requests = 0
+        self.n_errors = 0
+        self.last_error = None
+        self.last_success = None
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def _handshake(self, sock):
+        """
+        Called with the new socket once connected, e.g to read a welcome message.
+        """
+        pass
+
+    def connect(self):
+        with self.lock:
+            self.close()
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                s.settimeout(self.timeout)
+                s.connect((self.host, self.port))
+                self._handshake(s)
+            except:
+                s.close()
+                raise
+            self._sock = s
+            self.n_connects += 1
+
+    def close(self):
+        with self.lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except socket.error:
+                    pass
+            self._sock = None
+
+    def fail(self, err):
+        """
+        Record a communication error and drop the connection.
+        """
+        with self.lock:
+            self.n_errors += 1
+            self.last_error = str(err)
+            self.close()
+
+    def succeed(self, nrequests=1):
+        with self.lock:
+            self.n_requests += nrequests
+            self.last_success = time.time()
+
+    def health(self):
+        """
+        Summary of the state of this session.
+
+        Returns
+        -------
+        health : dict
+            connection state, counts of connections, requests and errors,
+            the last error message and the time of the last successful request
+        """
+        with self.lock:
+            return dict(
+                host=self.host, port=self.port,
+                connected=self.connected,
+                n_connects=self.n_connects,
+                n_requests=self.n_requests,
+                n_errors=self.n_errors,
+                last_error=self.last_error,
+                last_success=self.last_success
+            )
+
+
+class SessionPool(object):
+    """
+    The shared sessions of one kind, one per (host, port).
+
+    Parameters
+    ----------
+    session_class : type
+        `TCPSession` subclass to create, called as ``session_class(host, port, *args)``
+    """
+    def __init__(self, session_class):
+        self.session_class = session_class
+        self.lock = threading.Lock()
+        self._sessions = dict()
+
+    def get(self, host, port, *args):
+        """
+        Return the session for host:port, creating it if needed.
+        """
+        with self.lock:
+            key = (host, port)
+            if key not in self._sessions:
+                self._sessions[key] = self.session_class(host, port, *args)
+            return self._sessions[key]
+
+    def sessions(self):
+        with self.lock:
+            return list(self._sessions.values())
+
+    def health(self):
+        """
+        Health of every session, keyed by (host, port).
+        """
+        with self.lock:
+            sessions = list(self._sessions.items())
+        return {key: session.health() for key, session in sessions}
+
+    def close_all(self):
+        """
+        Close the connections of all sessions.
+        """
+        for session in self.sessions():
+            session.close()
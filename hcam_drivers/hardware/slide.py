@@ -106,6 +106,8 @@ class Slide(object):
         self.default_timeout = MIN_TIMEOUT
 
     def _sendRecv(self, byteArr, timeout):
+        # a new connection for each command, rather than a shared session,
+        # so a stop is not held up by a move waiting for its reply
         with netdevice(self.host, self.port) as dev:
             try:
                 dev.settimeout(self.default_timeout)
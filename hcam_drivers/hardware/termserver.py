@@ -1,12 +1,23 @@
 #!/usr/bin/env python
 
 """
-Provides a context manager for talking to serial devices over term server
+Provides a context manager and shared sessions for talking to serial devices over term server
 """
 from __future__ import (print_function, unicode_literals, division, absolute_import)
+import atexit
+import errno
+import json
+import os
 import socket
+import threading
+import time
 from contextlib import contextmanager
 
+from .session import TCPSession, SessionPool
+
+MAX_IDLE = 2  # seconds a session's connection is kept open without use
+
+
 @contextmanager
 def netdevice(host, port, timeout=5):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -16,3 +27,260 @@ def netdevice(host, port, timeout=5):
         yield s
     finally:
         s.close()
+
+
+class TermserverSession(TCPSession):
+    """
+    A long-lived TCP connection to one serial port of the terminal server.
+
+    The socket is opened on first use and kept open between requests, so
+    bursts of requests to a device do not pay for a new connection each time.
+    Serial ports on the terminal server usually accept one client at a time,
+    so sessions from `get_session` close once they have been idle for `max_idle`
+    seconds, letting other programs reach the device between polls.
+    Any data left over from an earlier request is discarded before sending.
+    Communication errors close the socket, and the next request reconnects.
+    If the connection was closed by the terminal server while idle, the request
+    is sent once more on a new connection. Access is serialised with a lock, so
+    a session can be shared between threads.
+
+    Sessions should normally be obtained with `get_session`, so that all
+    objects talking to the same port share one connection.
+
+    Parameters
+    ----------
+    host : string
+        IP address of terminal server
+    port : int
+        port number of serial device
+    timeout : float
+        socket timeout in seconds
+    max_idle : float
+        time in seconds after which an unused connection is closed
+    """
+    def __init__(self, host, port, timeout=5, max_idle=MAX_IDLE):
+        TCPSession.__init__(self, host, port, timeout)
+        self.max_idle = max_idle
+        self.last_used = 0
+
+    def _drain(self):
+        """
+        Discard any unread data, e.g a late reply to a request that timed out.
+
+        Raises EOFError if the terminal server has closed the connection.
+        """
+        self._sock.setblocking(False)
+        try:
+            while True:
+                if not self._sock.recv(1024):
+                    raise EOFError('connection closed by terminal server')
+        except socket.error as err:
+            if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise EOFError('connection lost: {}'.format(err))
+        finally:
+            self._sock.settimeout(self.timeout)
+
+    def _recv(self, bufsize):
+        data = self._sock.recv(bufsize)
+        if not data:
+            raise EOFError('connection closed by terminal server')
+        return data
+
+    def _exchange(self, msg, timeout, bufsize, terminator):
+        if self._sock is None:
+            self.connect()
+        else:
+            self._drain()
+        self._sock.sendall(msg)
+        self._sock.settimeout(self.timeout if timeout is None else timeout)
+        try:
+            response = self._recv(bufsize)
+            if terminator is not None:
+                response = bytearray(response)
+                start = 0
+                while response.find(terminator, start) < 0:
+                    # only search the new data, and enough old data to catch a split terminator
+                    start = max(0, len(response) - len(terminator) + 1)
+                    response += self._recv(bufsize)
+                response = bytes(response)
+        finally:
+            self._sock.settimeout(self.timeout)
+        return response
+
+    def exchange(self, msg, timeout=None, bufsize=1024, terminator=None):
+        """
+        Send a message, and return the reply.
+
+        Parameters
+        ----------
+        msg : bytes
+            message to send
+        timeout : float, optional
+            time in seconds to wait for a reply. Defaults to the session's timeout.
+        bufsize : int
+            maximum number of bytes to read at once
+        terminator : bytes, optional
+            if given, keep reading until this appears in the reply. Otherwise
+            the reply is the result of a single read. The timeout applies to
+            each read.
+        """
+        with self.lock:
+            reused = self._sock is not None
+            try:
+                try:
+                    response = self._exchange(msg, timeout, bufsize, terminator)
+                except (EOFError, socket.error) as err:
+                    if not reused or isinstance(err, socket.timeout):
+                        raise
+                    # connection was closed while idle, so try once on a new one
+                    self.connect()
+                    response = self._exchange(msg, timeout, bufsize, terminator)
+            except Exception as err:
+                self.fail(err)
+                raise
+            finally:
+                self.last_used = time.time()
+            self.succeed()
+            return response
+
+    def close_if_idle(self):
+        """
+        Close the connection if it has not been used for `max_idle` seconds.
+        """
+        # a session in use is not idle, so don't wait for it
+        if not self.lock.acquire(False):
+            return
+        try:
+            if self._sock is not None and time.time() - self.last_used > self.max_idle:
+                self.close()
+        finally:
+            self.lock.release()
+
+
+class IdentityCache(object):
+    """
+    Identities of devices on the terminal server, saved to disk so they survive restarts.
+
+    Each entry is a dictionary, e.g the bus address and serial number of the
+    device, keyed by the host and port of the device. The file is only
+    written when an entry changes. If it cannot be read or written, the cache
+    still works, but only for the lifetime of the program.
+
+    Parameters
+    ----------
+    path : string
+        JSON file to keep identities in
+    """
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        self._entries = None
+
+    @staticmethod
+    def _key(host, port):
+        return '{}:{}'.format(host, port)
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as fileobj:
+                    self._entries = json.load(fileobj)
+            except (IOError, OSError, ValueError):
+                self._entries = dict()
+        return self._entries
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(tmp, 'w') as fileobj:
+                json.dump(self._entries, fileobj, indent=1, sort_keys=True)
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+    def get(self, host, port):
+        """
+        Identity of the device on host:port, or None if not known.
+        """
+        with self.lock:
+            entry = self._load().get(self._key(host, port))
+            return None if entry is None else dict(entry)
+
+    def set(self, host, port, identity):
+        """
+        Replace the identity of the device on host:port.
+        """
+        with self.lock:
+            key = self._key(host, port)
+            if self._load().get(key) != identity:
+                self._entries[key] = dict(identity)
+                self._save()
+
+    def update(self, host, port, **identity):
+        """
+        Add to the identity of the device on host:port.
+        """
+        with self.lock:
+            entry = self._load().setdefault(self._key(host, port), dict())
+            if any(entry.get(name) != value for name, value in identity.items()):
+                entry.update(identity)
+                self._save()
+
+    def forget(self, host, port):
+        """
+        Remove the device on host:port, e.g because it has been replaced.
+        """
+        with self.lock:
+            if self._load().pop(self._key(host, port), None) is not None:
+                self._save()
+
+
+identity_cache = IdentityCache('~/.hdriver/termserver_devices.json')
+
+
+pool = SessionPool(TermserverSession)
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def _close_idle_sessions():
+    while True:
+        time.sleep(0.5)
+        for session in pool.sessions():
+            session.close_if_idle()
+
+
+def get_session(host, port, timeout=5):
+    """
+    Return the shared `TermserverSession` for a port, creating it if needed.
+
+    A background thread closes the connections of idle sessions.
+    """
+    global _reaper
+    session = pool.get(host, port, timeout)
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = threading.Thread(target=_close_idle_sessions, name='TermserverReaper')
+            _reaper.daemon = True
+            _reaper.start()
+    return session
+
+
+def pool_health():
+    """
+    Health of every open session, keyed by (host, port).
+    """
+    return pool.health()
+
+
+def close_all():
+    """
+    Close all sessions, freeing the terminal server ports for other programs.
+    """
+    pool.close_all()
+
+
+atexit.register(close_all)
@@ -1,14 +1,32 @@
 # Utility to query and set temp, and start circulation on Huber Unichiller 025-MPC+
 from __future__ import absolute_import, unicode_literals, print_function, division
 import time
+from collections import namedtuple
 
-from .termserver import netdevice
+from .termserver import get_session
+from ..utils import telemetry
 
 QUERY_DEV = '[M01V07'
 QUERY_STATUS = '[M01G0D******'
 STATE_CONTROL = '[M01G0D{}*****'
 TEMP_SET = '[M01G0D**{}'
 DEFAULT_TIMEOUT = 2
+DEFAULT_INTERVAL = 5  # seconds between status queries
+
+MODES = {
+    'C': 'pump on',
+    'I': 'pump on, cooling on',
+    'O': 'control off'
+}
+
+ChillerState = namedtuple('ChillerState', ['mode', 'alarms', 'setpoint', 'temperature', 'time'])
+ChillerState.__doc__ = """
+Status of the chiller from one query: the operating mode, True if an alarm is
+active, the setpoint and temperature in C, and the unix time of the query.
+"""
+
+# latest state of each chiller, shared by all objects talking to it
+_states = dict()
 
 
 def hex_to_float(hexstring):
@@ -39,10 +57,18 @@ class UnichillerMPC(object):
     Unichiller from Huber.
 
     See LAI protocol spec document for details.
+
+    The status of the chiller is read with one query, and the resulting
+    `ChillerState` shared by everything that talks to the same chiller. It is
+    only read again once it is older than `interval` seconds, so the temperature,
+    setpoint, alarms and mode can all be read without extra queries.
     """
-    def __init__(self, host, port):
+    def __init__(self, host, port, interval=DEFAULT_INTERVAL):
         self.host = host
         self.port = port
+        self.interval = interval
+        self.device_id = ('termserver', host, port)
+        self.session = get_session(host, port, DEFAULT_TIMEOUT)
 
     def _checksum(self, msg):
         """
@@ -60,9 +86,7 @@ class UnichillerMPC(object):
 
     def _send_recv(self, msg):
         msg += self._checksum(msg) + '\r'
-        with netdevice(self.host, self.port, DEFAULT_TIMEOUT) as dev:
-            dev.send(msg.encode())
-            response = dev.recv(1024).decode().rstrip('\r')
+        response = self.session.exchange(msg.encode(), DEFAULT_TIMEOUT).decode().rstrip('\r')
         self._check_response(msg, response)
         return response
 
@@ -80,32 +104,85 @@ class UnichillerMPC(object):
                             msg, response
                           ))
 
-    def get_status(self):
+    def read_state(self):
+        """
+        Query the chiller status, and share the result.
+
+        Returns
+        -------
+        state : `ChillerState`
+        """
         response = self._send_recv(QUERY_STATUS)
         body = response[7:-2]
-        status = dict()
-        op_status = body[0]
-        status['mode'] = {
-            'C': 'pump on',
-            'I': 'pump on, cooling on',
-            'O': 'control off'
-        }[op_status]
-        alarm_status = body[1]
-        status['alarms'] = True if alarm_status == '1' else False
-        status['setpoint'] = hex_to_float(body[2:6])
-        status['chiller_temp'] = hex_to_float(body[6:10])
-        return status
+        state = ChillerState(
+            mode=MODES[body[0]],
+            alarms=body[1] == '1',
+            setpoint=hex_to_float(body[2:6]),
+            temperature=hex_to_float(body[6:10]),
+            time=time.time()
+        )
+        _states[self.device_id] = state
+        telemetry.cache.put(self.device_id, None, 'temperature', state.temperature, state.time)
+        telemetry.cache.put(self.device_id, None, 'setpoint', state.setpoint, state.time)
+        telemetry.cache.put(self.device_id, None, 'alarms', state.alarms, state.time)
+        return state
+
+    def state(self, max_age=None):
+        """
+        Latest status of the chiller, only querying it if the last status is too old.
+
+        Parameters
+        ----------
+        max_age : float, optional
+            maximum age of status in seconds. Defaults to `interval`.
+
+        Returns
+        -------
+        state : `ChillerState`
+        """
+        if max_age is None:
+            max_age = self.interval
+        # the session lock is shared by everyone talking to this chiller,
+        # so simultaneous callers wait for one query instead of making their own
+        with self.session.lock:
+            state = _states.get(self.device_id)
+            if state is None or time.time() - state.time > max_age:
+                state = self.read_state()
+        return state
+
+    def invalidate(self):
+        """
+        Forget the shared status, so it is read again on next use.
+        """
+        _states.pop(self.device_id, None)
+
+    def get_status(self):
+        state = self.read_state()
+        return dict(mode=state.mode, alarms=state.alarms,
+                    setpoint=state.setpoint, chiller_temp=state.temperature)
+
+    @property
+    def mode(self):
+        return self.state().mode
+
+    @property
+    def alarms(self):
+        return self.state().alarms
+
+    @property
+    def setpoint(self):
+        return self.state().setpoint
 
     @property
     def temperature(self):
-        status = self.get_status()
-        return status['chiller_temp']
+        return self.state().temperature
 
     @temperature.setter
     def temperature(self, target):
         target_hex = float_to_hex(target)
         msg = TEMP_SET.format(target_hex)
         self._send_recv(msg)
+        self.invalidate()
 
     def pump_on(self):
         msg = STATE_CONTROL.format('C')
@@ -113,9 +190,9 @@ class UnichillerMPC(object):
         time.sleep(2)
         msg = STATE_CONTROL.format('I')
         self._send_recv(msg)
-
-
+        self.invalidate()
 
     def pump_off(self):
         msg = STATE_CONTROL.format('O')
         self._send_recv(msg)
+        self.invalidate()
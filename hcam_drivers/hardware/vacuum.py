@@ -1,13 +1,18 @@
 # Utility to communicate with MKS PDR900 Vacuum Guage via RS232
 from __future__ import absolute_import, unicode_literals, print_function, division
 import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from astropy.utils.decorators import lazyproperty
+import numpy as np
 from astropy.time import Time, TimeDelta
-from astropy.io import ascii
+from astropy.table import Table
 from astropy import units as u
 
-from .termserver import netdevice
+from .termserver import get_session, identity_cache
+from ..utils import telemetry
 
 DEFAULT_TIMEOUT = 5  # seconds
 
@@ -27,18 +32,33 @@ class VacuumGaugeError(Exception):
 
 class PDR900(object):
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, identities=identity_cache):
         """
         Creates a PDR900 object for communication over serial.
 
+        The address, serial number and firmware version of the gauge are
+        saved in an identity cache, so they need not be asked for again when
+        the program restarts. The cached identity is checked against the
+        gauge's serial number on first contact, and refreshed if it does not match.
+
         Parameters
         -----------
+         host : string
+            IP address of terminal server
          port : string
             port device representing the vacuum gauge
+         identities : `~hcam_drivers.hardware.termserver.IdentityCache`
+            cache of gauge identities
         """
         self.port = port
         self.host = host
+        self.device_id = ('termserver', host, port)
+        self.session = get_session(host, port, DEFAULT_TIMEOUT)
+        self.identities = identities
         self.logging_start_time = None
+        self._identity = None
+        # True once self._identity has been checked against the gauge
+        self._checked = False
 
     def _parse_response(self, response):
         pattern = '@(.*)ACK(.*);FF'
@@ -53,50 +73,106 @@ class PDR900(object):
             ))
         return result.groups()
 
-    def _send_recv(self, message, data):
+    def _send_recv(self, message, data, timeout=DEFAULT_TIMEOUT):
         msg = message.format(**data).encode()
-        with netdevice(self.host, self.port, DEFAULT_TIMEOUT) as dev:
-            dev.send(msg)
-            dev.settimeout(DEFAULT_TIMEOUT)
-            response = dev.recv(1024).decode().rstrip('\r\n')
+        response = self.session.exchange(msg, timeout).decode().rstrip('\r\n')
         addr, retval = self._parse_response(response)
         return addr, retval
 
-    @lazyproperty
-    def address(self):
-        # connect once to find address and hard-code
+    def _discover(self, timeout):
+        # ask whichever gauge is on this port for its address
         data = dict(addr=254, comm='?')
-        _, addr = self._send_recv(ADDRESS, data)
-        return int(addr)
+        _, addr = self._send_recv(ADDRESS, data, timeout)
+        self._identity = dict(address=int(addr))
+        self._checked = True
+        self.identities.set(self.host, self.port, self._identity)
+
+    def _check(self, timeout):
+        """
+        Check a cached identity against the gauge, on first contact.
+
+        The serial number is asked for at the cached address. Gauges share
+        a default address, so a replaced gauge is spotted by its serial number,
+        and its old identity dropped. If the gauge does not answer at the cached
+        address, the address is looked up again.
+        """
+        address = self.get_address(timeout)
+        if self._checked:
+            return
+        try:
+            addr, serno = self._send_recv(SERIAL_NO, dict(addr=address, comm='?'), timeout)
+            if int(addr) != address:
+                raise VacuumGaugeError('reply from address {} instead of {}'.format(addr, address))
+        except (VacuumGaugeError, ValueError, socket.timeout):
+            self._discover(timeout)
+            return
+        if serno != self._identity.get('serial_number'):
+            self._identity = dict(address=address, serial_number=serno)
+            self.identities.set(self.host, self.port, self._identity)
+        self._checked = True
+
+    def _query(self, message, comm, timeout=DEFAULT_TIMEOUT):
+        """
+        Send a command to the gauge, and return the reply.
+        """
+        self._check(timeout)
+        data = dict(addr=self._identity['address'], comm=comm)
+        return self._send_recv(message, data, timeout)
+
+    def _cached(self, name, message, timeout=DEFAULT_TIMEOUT):
+        """
+        Value from the identity cache, asking the gauge if not known.
+        """
+        self._check(timeout)
+        if name not in self._identity:
+            _, value = self._query(message, '?', timeout)
+            self._identity[name] = value
+            self.identities.update(self.host, self.port, **{name: value})
+        return self._identity[name]
+
+    @property
+    def address(self):
+        return self.get_address()
 
-    @lazyproperty
+    def get_address(self, timeout=DEFAULT_TIMEOUT):
+        # address is looked up once, or taken from the identity cache. Not a lazyproperty,
+        # whose lock is shared by all gauges, so one dead gauge would hold up the others
+        if self._identity is None:
+            identity = self.identities.get(self.host, self.port)
+            if identity is not None and 'address' in identity:
+                self._identity = identity
+            else:
+                self._discover(timeout)
+        return self._identity['address']
+
+    @property
     def firmware_version(self):
-        data = dict(addr=self.address, comm='?')
-        _, fwver = self._send_recv(FIRMWARE, data)
-        return fwver
+        return self._cached('firmware_version', FIRMWARE)
 
-    @lazyproperty
+    @property
     def serial_number(self):
-        data = dict(addr=self.address, comm='?')
-        _, serno = self._send_recv(SERIAL_NO, data)
-        return serno
+        return self._cached('serial_number', SERIAL_NO)
 
     @property
     def pressure(self):
-        data = dict(addr=self.address, comm='?')
-        addr, response = self._send_recv(PRESSURE, data)
+        return self.read_pressure()
+
+    def read_pressure(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Read the pressure, waiting at most timeout seconds for the reply.
+        """
+        addr, response = self._query(PRESSURE, '?', timeout)
+        telemetry.cache.put(self.device_id, None, 'pressure', float(response))  # mbar
         return float(response) * u.bar / 1000
 
     def start_logging(self):
-        data = dict(addr=self.address, comm='!START')
-        addr, response = self._send_recv(DLOG_CTRL, data)
+        addr, response = self._query(DLOG_CTRL, '!START')
         if response != 'START':
             raise VacuumGaugeError('failed to start logging')
         self.logging_start_time = Time.now()
 
     def stop_logging(self):
-        data = dict(addr=self.address, comm='!STOP')
-        addr, response = self._send_recv(DLOG_CTRL, data)
+        addr, response = self._query(DLOG_CTRL, '!STOP')
         if response != 'STOP':
             raise VacuumGaugeError('failed to stop logging')
         self.logging_start_time = Time.now()
@@ -105,22 +181,231 @@ class PDR900(object):
         assert secs < 60, 'seconds must be less than 60'
         assert mins < 60, 'minutes must be less than 60'
         tstring = '!{:02d}:{:02d}:{:02d}'.format(hours, mins, secs)
-        data = dict(addr=self.address, comm=tstring)
-        addr, response = self._send_recv(DLOG_TIME, data)
+        addr, response = self._query(DLOG_TIME, tstring)
         if response != tstring[1:]:
             raise VacuumGaugeError('failed to set logging time')
 
     def get_log_interval(self):
-        data = dict(addr=self.address, comm='?')
-        addr, response = self._send_recv(DLOG_TIME, data)
+        addr, response = self._query(DLOG_TIME, '?')
         try:
             h, m, s = [float(val) for val in response.split(':')]
         except:
             raise VacuumGaugeError('cannot parse log interval response: ' + response)
         return TimeDelta(3600*h + 60*m + s, format='sec')
 
+    def download_log(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Download the onboard data log.
+
+        The reply is read until the end of text character that ends the log,
+        however long the log is.
+
+        Returns
+        -------
+        lines : list
+            lines of the log, starting with the column names
+        """
+        msg = DOWNLOAD.format(addr=self.get_address(timeout), comm='?').encode()
+        response = self.session.exchange(msg, timeout, terminator=b'\x03')
+        response = response.decode('ascii', 'replace')
+        _, ack, pdata = response.partition('ACK')
+        if not ack:
+            raise VacuumGaugeError('could not parse log download {}'.format(response[:80]))
+        pdata = pdata.split('\x03')[0]
+        return [line for line in re.split('[\r\n]+', pdata) if line.strip()]
+
     def get_log_data(self):
-        data = dict(addr=self.address, comm='?')
-        addr, pdata = self._send_recv(DOWNLOAD, data)
-        pdata = pdata.rstrip('\x03').replace('\r', '\n')
-        return ascii.read(pdata, delimiter=';')
+        log = PDR900Log(self)
+        log.update()
+        return log.table()
+
+
+def _append(old, new):
+    if old.dtype.kind != new.dtype.kind:
+        # a column of numbers has gained text
+        old, new = old.astype(str), new.astype(str)
+    return np.concatenate((old, new))
+
+
+class PDR900Log(object):
+    """
+    The onboard data log of a PDR900, parsed into NumPy arrays.
+
+    Each call to `update` downloads the log, but only parses the records added
+    since the last call. If the log has been restarted, it is parsed again
+    from the start.
+
+    Records are timestamped from the gauge's `logging_start_time` and
+    log interval, with the first record at the start time. If the start time
+    is not known, e.g because logging was started by another program, the
+    times are NaN.
+
+    Parameters
+    ----------
+    gauge : `PDR900`
+        gauge to read the log from
+
+    Attributes
+    ----------
+    names : list
+        names of the columns of the log
+    columns : list
+        one `numpy.ndarray` per column. Columns of numbers are floats, anything
+        else is kept as strings.
+    mjd : `numpy.ndarray`
+        MJD of each record
+    """
+    def __init__(self, gauge):
+        self.gauge = gauge
+        self.reset()
+
+    def reset(self):
+        self.names = None
+        self.columns = None
+        self.mjd = np.array([])
+        self.interval = None
+        self.start_time = None
+        self.nlines = 0
+
+    def __len__(self):
+        return len(self.mjd)
+
+    def _parse(self, lines, first):
+        """
+        Parse lines of the log. first is the record number of the first line.
+
+        Returns the record numbers of the lines which could be parsed, and the columns.
+        """
+        rows = [line.rstrip(';').split(';') for line in lines]
+        index = [first + i for i, row in enumerate(rows) if len(row) == len(self.names)]
+        if not index:
+            return None, None
+        table = np.array([rows[i - first] for i in index])
+        columns = []
+        for column in table.T:
+            try:
+                columns.append(column.astype(float))
+            except ValueError:
+                columns.append(np.char.strip(column))
+        return np.array(index), columns
+
+    def update(self, timeout=DEFAULT_TIMEOUT):
+        """
+        Download the log, and add any new records.
+
+        Returns
+        -------
+        nnew : int
+            number of new records
+        """
+        lines = self.gauge.download_log(timeout)
+        if not lines:
+            self.reset()
+            return 0
+        names = [name.strip() for name in lines[0].rstrip(';').split(';')]
+        records = lines[1:]
+        if (names != self.names or len(records) < self.nlines or
+                self.gauge.logging_start_time is not self.start_time):
+            # new or restarted log
+            self.reset()
+            self.names = names
+            self.start_time = self.gauge.logging_start_time
+            self.interval = self.gauge.get_log_interval().to(u.day).value
+
+        index, new = self._parse(records[self.nlines:], self.nlines)
+        self.nlines = len(records)
+        if index is None:
+            return 0
+        if self.columns is None:
+            self.columns = new
+        else:
+            self.columns = [_append(old, extra) for old, extra in zip(self.columns, new)]
+        start = np.nan if self.start_time is None else self.start_time.mjd
+        self.mjd = np.concatenate((self.mjd, start + self.interval * index))
+        return len(index)
+
+    def table(self):
+        """
+        The log as a `~astropy.table.Table`, with a column of MJDs added.
+        """
+        if self.columns is None:
+            return Table()
+        table = Table(self.columns, names=self.names)
+        table['MJD'] = self.mjd
+        return table
+
+
+class PDR900Group(object):
+    """
+    Reads the pressure of several PDR900 gauges at the same time.
+
+    Each gauge is read in its own thread, and a sweep waits at most `timeout`
+    seconds for all of them, so one dead gauge costs a sweep no more than
+    the slowest reply. Gauges that have not replied by then are reported as
+    errors. A gauge still busy with a read from an earlier sweep is not
+    queried again until that read finishes.
+
+    Parameters
+    ----------
+    gauges : iterable
+        `PDR900` gauges to read
+    timeout : float
+        time in seconds to wait for each gauge
+    """
+    def __init__(self, gauges, timeout=DEFAULT_TIMEOUT):
+        self.gauges = list(gauges)
+        self.timeout = timeout
+        self.device_id = ('gauge group',) + tuple(gauge.device_id for gauge in self.gauges)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.gauges)))
+        # index -> read from an earlier sweep which has not finished
+        self._running = dict()
+        # (time, pressures, errors) of latest sweep
+        self.last_sweep = None
+
+    def read_pressures(self, max_age=0):
+        """
+        Read all gauges.
+
+        Parameters
+        ----------
+        max_age : float
+            if the last sweep is more recent than this many seconds, return its
+            results instead of reading the gauges again
+
+        Returns
+        -------
+        pressures : dict
+            pressure as a `~astropy.units.Quantity`, keyed by the index of the gauge
+        errors : dict
+            exception raised by each gauge that could not be read, keyed by index
+        """
+        with self.lock:
+            if self.last_sweep is not None and time.time() - self.last_sweep[0] <= max_age:
+                return self.last_sweep[1], self.last_sweep[2]
+
+            pressures = dict()
+            errors = dict()
+            futures = dict()
+            for index, gauge in enumerate(self.gauges):
+                running = self._running.get(index)
+                if running is not None and not running.done():
+                    errors[index] = VacuumGaugeError(
+                        'still waiting for reply to previous read of gauge {}'.format(index))
+                else:
+                    futures[index] = self.pool.submit(gauge.read_pressure, self.timeout)
+            self._running.update(futures)
+            wait(list(futures.values()), timeout=self.timeout)
+
+            for index, future in futures.items():
+                if not future.done():
+                    errors[index] = VacuumGaugeError(
+                        'no reply from gauge {} within {} s'.format(index, self.timeout))
+                    continue
+                del self._running[index]
+                try:
+                    pressures[index] = future.result()
+                except Exception as err:
+                    errors[index] = err
+            self.last_sweep = (time.time(), pressures, errors)
+            return pressures, errors
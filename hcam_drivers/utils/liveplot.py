@@ -0,0 +1,187 @@
+# Tools for long-running live plots whose redraw cost does not grow with time
+from __future__ import print_function, unicode_literals, absolute_import, division
+import math
+
+import numpy as np
+
+
+class DecimatedSeries(object):
+    """
+    A time series for plotting, with bounded size however many points are added.
+
+    The most recent points are kept at full resolution. Older points are
+    grouped into bins, and each bin is replaced by its minimum and maximum,
+    so spikes and dropouts in old data stay visible. Whenever the decimated
+    section grows too big, neighbouring bins are merged and the bin size doubles.
+
+    Points are added one at a time with `append`, at constant cost.
+
+    Parameters
+    ----------
+    recent_size : int
+        number of points kept at full resolution
+    max_decimated : int
+        maximum number of points used to represent older data. Rounded down
+        to a multiple of 4, since merging bins takes 4 points at a time.
+    """
+    def __init__(self, recent_size=500, max_decimated=1000):
+        self.recent_size = recent_size
+        self.max_decimated = max(4, 4 * (max_decimated // 4))
+        self.factor = 1
+        self._recent_t = np.zeros(recent_size)
+        self._recent_v = np.zeros(recent_size)
+        self._nrecent = 0
+        self._start = 0
+        self._old_t = np.zeros(self.max_decimated)
+        self._old_v = np.zeros(self.max_decimated)
+        self._nold = 0
+        self._reset_bin()
+
+    def __len__(self):
+        return self._nold + self._nrecent
+
+    def _reset_bin(self):
+        self._bin_count = 0
+        self._bin_first = None
+        self._bin_last = None
+        self._bin_min = (None, np.nan)
+        self._bin_max = (None, np.nan)
+
+    def append(self, t, v):
+        if self._nrecent == self.recent_size:
+            # oldest recent point moves into the decimated section
+            self._add_to_bin(self._recent_t[self._start], self._recent_v[self._start])
+            self._recent_t[self._start] = t
+            self._recent_v[self._start] = v
+            self._start = (self._start + 1) % self.recent_size
+        else:
+            index = (self._start + self._nrecent) % self.recent_size
+            self._recent_t[index] = t
+            self._recent_v[index] = v
+            self._nrecent += 1
+
+    def _add_to_bin(self, t, v):
+        if self._bin_count == 0:
+            self._bin_first = t
+        self._bin_last = t
+        self._bin_count += 1
+        if not math.isnan(v):
+            if self._bin_min[0] is None or v < self._bin_min[1]:
+                self._bin_min = (t, v)
+            if self._bin_max[0] is None or v > self._bin_max[1]:
+                self._bin_max = (t, v)
+        if self._bin_count >= self.factor:
+            self._close_bin()
+
+    def _close_bin(self):
+        if self._bin_min[0] is None:
+            # no valid data in bin; leave a gap
+            points = [(self._bin_first, np.nan), (self._bin_last, np.nan)]
+        else:
+            points = sorted([self._bin_min, self._bin_max])
+        if self._nold == self.max_decimated:
+            self._compact()
+        for t, v in points:
+            self._old_t[self._nold] = t
+            self._old_v[self._nold] = v
+            self._nold += 1
+        self._reset_bin()
+
+    def _compact(self):
+        """
+        Merge neighbouring bins, halving the size of the decimated section.
+        """
+        t = self._old_t[:self._nold].reshape(-1, 4).copy()
+        v = self._old_v[:self._nold].reshape(-1, 4).copy()
+        imin = np.argmin(np.where(np.isnan(v), np.inf, v), axis=1)
+        imax = np.argmax(np.where(np.isnan(v), -np.inf, v), axis=1)
+        rows = np.arange(len(t))
+        # keep min and max of each merged bin, in time order
+        first = np.minimum(imin, imax)
+        second = np.maximum(imin, imax)
+        nnew = 2 * len(t)
+        self._old_t[0:nnew:2] = t[rows, first]
+        self._old_v[0:nnew:2] = v[rows, first]
+        self._old_t[1:nnew:2] = t[rows, second]
+        self._old_v[1:nnew:2] = v[rows, second]
+        self._nold = nnew
+        self.factor *= 2
+
+    def data(self):
+        """
+        Points to plot, oldest first.
+
+        Returns
+        -------
+        t, v : `numpy.ndarray`
+            times and values
+        """
+        order = (self._start + np.arange(self._nrecent)) % self.recent_size
+        # include the bin that is still being filled
+        if self._bin_count == 0:
+            bin_t, bin_v = [], []
+        elif self._bin_min[0] is None:
+            bin_t, bin_v = [self._bin_first, self._bin_last], [np.nan, np.nan]
+        else:
+            (tmin, vmin), (tmax, vmax) = sorted([self._bin_min, self._bin_max])
+            bin_t, bin_v = [tmin, tmax], [vmin, vmax]
+        t = np.concatenate((self._old_t[:self._nold], bin_t, self._recent_t[order]))
+        v = np.concatenate((self._old_v[:self._nold], bin_v, self._recent_v[order]))
+        return t, v
+
+
+class BlitManager(object):
+    """
+    Redraws a few animated artists on a matplotlib figure without redrawing the rest.
+
+    The artists are marked as animated, so a full draw of the figure leaves them
+    out. The rendered background is saved after each full draw, and `update`
+    restores it and draws only the animated artists on top. A full redraw is
+    only needed when something else changes, e.g. the axis limits; call
+    `redraw` then.
+
+    If the canvas does not support blitting, `update` falls back to a full redraw.
+
+    Parameters
+    ----------
+    canvas : `matplotlib.backend_bases.FigureCanvasBase`
+        canvas of figure
+    artists : list
+        artists to animate
+    """
+    def __init__(self, canvas, artists):
+        self.canvas = canvas
+        self.artists = list(artists)
+        self.background = None
+        self.blit = getattr(canvas, 'supports_blit', False)
+        for artist in self.artists:
+            artist.set_animated(self.blit)
+        self.cid = canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _on_draw(self, event):
+        if not self.blit:
+            return
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self.artists:
+            self.canvas.figure.draw_artist(artist)
+
+    def redraw(self):
+        """
+        Full redraw of figure, including animated artists.
+        """
+        self.canvas.draw()
+
+    def update(self):
+        """
+        Redraw the animated artists only.
+        """
+        if not self.blit or self.background is None:
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_animated()
+            self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
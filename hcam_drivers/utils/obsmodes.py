@@ -1,7 +1,7 @@
 # The task of the classes and functions here is to convert
 # JSON encoded instrument setups into an
 from __future__ import print_function, unicode_literals, absolute_import, division
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from itertools import islice
 
 
@@ -19,6 +19,22 @@ def get_obsmode(setup_data):
         raise ValueError('Unrecognised mode: {}'.format(mode))
 
 
+def format_setup(params):
+    """
+    Make a setup command from (key, value) pairs, quoting values with spaces.
+    """
+    setup_string = 'setup'
+    for key, value in params:
+        # add quotes to strings with spaces
+        try:
+            if ' ' in value:
+                value = '"' + value + '"'
+        except:
+            pass
+        setup_string += ' {} {} '.format(key, value)
+    return setup_string
+
+
 class ObsMode(object):
 
     def __init__(self, setup_data):
@@ -222,20 +238,127 @@ class ObsMode(object):
 
         setup_strings = []
         for chunk in chunks(self.userpars):
-            setup_string = 'setup'
-            for key in chunk:
-                if chunk[key] != '':
-                    value = chunk[key]
-                    # add quotes to strings with spaces
-                    try:
-                        if ' ' in value:
-                            value = '"' + value + '"'
-                    except:
-                        pass
-                    setup_string += ' {} {} '.format(key, value)
-            setup_strings.append(setup_string)
+            setup_strings.append(format_setup((key, chunk[key]) for key in chunk
+                                              if chunk[key] != ''))
         return setup_strings
 
+    @property
+    def setup_pars(self):
+        """
+        Detector parameters sent by `setup_command`
+        """
+        pars = OrderedDict(self.detpars)
+        # always sent, so an unlimited run resets the break count of a finite one
+        pars['DET.FRAM2.BREAK'] = self.finite if self.finite else 0
+        return pars
+
+
+SetupStep = namedtuple('SetupStep', ['name', 'command', 'params'])
+SetupStep.__doc__ = """
+One command to send when setting up a run.
+
+name is a short description, command the ngcbCmd command, and params
+a dict of the parameters the command sets.
+"""
+
+
+class SetupPlanner(object):
+    """
+    Plans the commands needed to set up a run, sending as little as possible.
+
+    The planner remembers what the last setups applied to the controller. When
+    planning a new setup, the read mode and acquisition commands are only sent
+    if they have changed, and only header and detector parameters with new
+    values are sent. Changed header parameters are packed into as few setup
+    commands as the controller accepts, and changed detector parameters are
+    sent in a single command, as `ObsMode.setup_command` does.
+
+    Changing the read mode loads a new sequencer file, so everything is sent
+    again after that. Parameters cannot be cleared with a setup command, so if a
+    previously applied parameter is blank or missing from the new setup, the read
+    mode is reloaded to clear it, and everything sent again. Call `forget` if the
+    state of the controller may have changed in some other way, or a command has
+    failed.
+
+    For example::
+
+        >> planner = SetupPlanner()
+        >> for step in planner.plan(obsmode):
+        >>     send(step.command)
+        >>     planner.record(step)
+
+    Parameters
+    ----------
+    max_keys : int
+        maximum number of header parameters sent in one setup command
+    """
+    def __init__(self, max_keys=10):
+        self.max_keys = max_keys
+        self.forget()
+
+    def forget(self):
+        """
+        Forget the state of the controller, so the next setup is sent in full.
+        """
+        self.readmode_command = None
+        self.acq_command = None
+        self.applied = dict()
+
+    def record(self, step):
+        """
+        Note that a step returned by `plan` has been applied successfully.
+        """
+        if step.name == 'read mode':
+            self.applied = dict()
+            self.readmode_command = step.command
+        elif step.name == 'acquisition':
+            self.acq_command = step.command
+        self.applied.update(step.params)
+
+    def _changed(self, params):
+        return [(key, value) for key, value in params if
+                key not in self.applied or str(self.applied[key]) != str(value)]
+
+    def plan(self, obsmode):
+        """
+        Commands needed to change from the last setup applied to obsmode.
+
+        Returns
+        -------
+        steps : list
+            `SetupStep` objects, in the order they should be sent
+        """
+        header = [(key, value) for key, value in obsmode.userpars.items() if value != '']
+        detector = list(obsmode.setup_pars.items())
+        new_keys = set(key for key, value in header + detector)
+
+        steps = [SetupStep('stop sequencer', 'seq stop', {})]
+        # stale parameters can only be cleared by reloading the read mode
+        resend = (obsmode.readmode_command != self.readmode_command or
+                  any(key not in new_keys for key in self.applied))
+        if resend:
+            steps.append(SetupStep('read mode', obsmode.readmode_command, {}))
+        if resend or obsmode.acq_command != self.acq_command:
+            steps.append(SetupStep('acquisition', obsmode.acq_command, {}))
+
+        def changed(params):
+            return params if resend else self._changed(params)
+
+        header = changed(header)
+        for i in range(0, len(header), self.max_keys):
+            chunk = header[i:i+self.max_keys]
+            steps.append(SetupStep('header', format_setup(chunk), dict(chunk)))
+        detector = changed(detector)
+        if detector:
+            steps.append(SetupStep('detector', format_setup(detector), dict(detector)))
+
+        if isinstance(obsmode, Idle):
+            # a run start will start the sequencer automatically, and save data,
+            # but there is no run start when we switch into idle mode,
+            # so start the sequencer by hand
+            steps.append(SetupStep('start sequencer', 'seq start', {}))
+        return steps
+
 
 class FullFrame(ObsMode):
     def __init__(self, setup_data):
@@ -0,0 +1,160 @@
+# A single scheduler for all background hardware reads made by the GUI
+from __future__ import print_function, unicode_literals, absolute_import, division
+import threading
+import traceback
+from collections import OrderedDict
+
+import six
+if not six.PY3:
+    from Queue import Queue, Empty
+else:
+    from queue import Queue, Empty
+
+
+class HardwarePoller(object):
+    """
+    Runs hardware reads for many widgets on a small, fixed pool of threads.
+
+    Reads are requested with `request`. Requests are grouped by the physical
+    device they talk to, and each group is run in turn by a single worker, so
+    a device is never read from two threads at once and reads to one device
+    happen back-to-back. Different devices are read in parallel.
+
+    If a read with the same key is already waiting or running, the new request
+    is collapsed into the existing one and both callers receive the same result.
+    Keys should therefore name the physical quantity read, rather than the
+    widget asking for it.
+
+    Results are passed back through one thread-safe queue, which is emptied in
+    the Tk main thread, where the callbacks are called. Callbacks can therefore
+    safely update widgets. The queue is only checked while reads are
+    outstanding, so an idle poller costs nothing.
+
+    Parameters
+    ----------
+    widget : tk.Widget
+        any widget, used to schedule work in the Tk main loop
+    nworkers : int
+        number of worker threads
+    interval : int
+        time in milliseconds between checks for finished reads
+    """
+    def __init__(self, widget, nworkers=4, interval=50):
+        self.widget = widget
+        self.interval = interval
+        self.lock = threading.Lock()
+        # device -> OrderedDict(key -> function) of reads waiting to run
+        self.waiting = OrderedDict()
+        # key -> list of callbacks waiting for result
+        self.callbacks = dict()
+        # devices with a batch of reads in progress
+        self.busy = set()
+        self._dispatch_scheduled = False
+        self._pump_scheduled = False
+        self.jobs = Queue()
+        self.results = Queue()
+        self.workers = []
+        for i in range(nworkers):
+            t = threading.Thread(target=self._work, name='HardwarePoller-{}'.format(i))
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def request(self, device, key, function, callback):
+        """
+        Ask for a hardware read. Must be called from the Tk main thread.
+
+        Parameters
+        ----------
+        device : hashable
+            identifies the physical device that `function` talks to
+        key : hashable
+            identifies the value being read. Requests with the same key
+            share a single read.
+        function : callable
+            called with no arguments in a worker thread to do the read
+        callback : callable
+            called in the Tk main thread as ``callback(value, error)``, where
+            ``error`` is None, or the exception raised by `function`
+        """
+        with self.lock:
+            if key in self.callbacks:
+                self.callbacks[key].append(callback)
+                return
+            self.callbacks[key] = [callback]
+            self.waiting.setdefault(device, OrderedDict())[key] = function
+            schedule = not self._dispatch_scheduled
+            self._dispatch_scheduled = True
+        if schedule:
+            # wait until Tk is idle, so requests made together are grouped together
+            self.widget.after_idle(self._dispatch)
+        self._schedule_pump()
+
+    def _schedule_pump(self):
+        if not self._pump_scheduled:
+            self._pump_scheduled = True
+            self.widget.after(self.interval, self._pump)
+
+    def _dispatch(self):
+        """
+        Hand waiting reads to the workers, one batch per idle device.
+        """
+        with self.lock:
+            self._dispatch_scheduled = False
+            for device in list(self.waiting):
+                if device in self.busy:
+                    continue
+                self.busy.add(device)
+                self.jobs.put((device, self.waiting.pop(device)))
+
+    def _work(self):
+        while True:
+            device, batch = self.jobs.get()
+            for key, function in batch.items():
+                try:
+                    self.results.put((key, function(), None))
+                except Exception as err:
+                    self.results.put((key, None, err))
+            with self.lock:
+                self.busy.discard(device)
+
+    def _pump(self):
+        """
+        Deliver finished reads to their callbacks, and start any waiting reads.
+
+        Runs again after `interval` for as long as any reads are outstanding.
+        """
+        self._pump_scheduled = False
+        self._dispatch()
+        while True:
+            try:
+                key, value, error = self.results.get(block=False)
+            except Empty:
+                break
+            with self.lock:
+                callbacks = self.callbacks.pop(key, [])
+            for callback in callbacks:
+                try:
+                    callback(value, error)
+                except Exception:
+                    traceback.print_exc()
+        with self.lock:
+            outstanding = bool(self.callbacks)
+        if outstanding:
+            self._schedule_pump()
+
+
+def get_poller(g, widget):
+    """
+    Return the application-wide `HardwarePoller`, creating it if needed.
+
+    Parameters
+    ----------
+    g : hcam_widgets.globals.Container
+        application globals, where the poller is stored
+    widget : tk.Widget
+        any widget, used to schedule work in the Tk main loop
+    """
+    if getattr(g, 'hw_poller', None) is None:
+        g.hw_poller = HardwarePoller(widget)
+    return g.hw_poller
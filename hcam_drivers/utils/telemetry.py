@@ -0,0 +1,185 @@
+# Shared store of the most recent hardware readings
+from __future__ import print_function, unicode_literals, absolute_import, division
+import threading
+import time
+from collections import namedtuple
+
+
+Reading = namedtuple('Reading', ['value', 'time'])
+Reading.__doc__ = """
+A single hardware reading: a float value and the unix time it was acquired.
+"""
+
+
+class TelemetryCache(object):
+    """
+    A thread-safe store of the latest value of each monitored quantity.
+
+    Readings are keyed by (device, channel, quantity). The device identifies
+    a physical piece of hardware, e.g. ``('meerstetter', '192.168.1.5')``,
+    channel picks out one of several identical sensors on that device (use
+    None for single channel devices) and quantity names what was measured,
+    e.g. 'ccd_temp'.
+
+    Drivers write readings as they are made. Widgets, JSON dumps and monitors
+    read them back, so each physical quantity need only be read once, however
+    many things want to know its value. Readings older than the time-to-live
+    are treated as missing.
+
+    Failed reads can be stored too, so that when a device stops answering,
+    only the first read waits for it to time out.
+
+    Parameters
+    ----------
+    ttl : float
+        default maximum age of a reading, in seconds
+    """
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._readings = dict()
+        # key -> (exception, time) of failed reads
+        self._errors = dict()
+
+    def put(self, device, channel, quantity, value, timestamp=None):
+        """
+        Store a reading.
+
+        Parameters
+        ----------
+        device, channel, quantity : hashable
+            key for reading
+        value : float
+            the value read. Quantities should be converted to floats in the
+            natural units of the quantity before storing.
+        timestamp : float, optional
+            unix time reading was acquired. Defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        reading = Reading(float(value), timestamp)
+        with self.lock:
+            old = self._readings.get((device, channel, quantity))
+            if old is None or old.time <= timestamp:
+                self._readings[(device, channel, quantity)] = reading
+
+    def get(self, device, channel, quantity, max_age=None):
+        """
+        Return latest `Reading`, or None if there is none younger than max_age.
+
+        Parameters
+        ----------
+        device, channel, quantity : hashable
+            key for reading
+        max_age : float, optional
+            maximum age of reading in seconds. Defaults to the cache's ttl.
+        """
+        if max_age is None:
+            max_age = self.ttl
+        with self.lock:
+            reading = self._readings.get((device, channel, quantity))
+        if reading is None or time.time() - reading.time > max_age:
+            return None
+        return reading
+
+    def put_error(self, device, channel, quantity, error, timestamp=None):
+        """
+        Store a failed read.
+
+        Parameters
+        ----------
+        device, channel, quantity : hashable
+            key for reading
+        error : Exception
+            the exception raised by the read
+        timestamp : float, optional
+            unix time read was attempted. Defaults to now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self._errors[(device, channel, quantity)] = (error, timestamp)
+
+    def get_error(self, device, channel, quantity, max_age=None):
+        """
+        Return the exception raised by the latest read of a quantity.
+
+        None is returned if the latest read succeeded, or failed more than
+        max_age seconds ago.
+        """
+        if max_age is None:
+            max_age = self.ttl
+        key = (device, channel, quantity)
+        with self.lock:
+            reading = self._readings.get(key)
+            error, timestamp = self._errors.get(key, (None, None))
+        if error is None or time.time() - timestamp > max_age:
+            return None
+        if reading is not None and reading.time >= timestamp:
+            return None
+        return error
+
+    def fetch(self, device, channel, quantity, function, max_age=None):
+        """
+        Return latest `Reading`, calling function to read hardware if needed.
+
+        If there is no reading younger than max_age, ``function()`` is called
+        and its return value stored. Drivers often store many readings in a single
+        call, so later fetches of other quantities can be satisfied from the cache.
+
+        Failures are treated the same way: if the latest read failed less than
+        max_age ago, its exception is raised again without calling function, and
+        an exception raised by function is stored before being passed on.
+
+        Parameters
+        ----------
+        device, channel, quantity : hashable
+            key for reading
+        function : callable
+            called with no arguments, returns current value of quantity
+        max_age : float, optional
+            maximum age of reading in seconds. Defaults to the cache's ttl.
+        """
+        reading = self.get(device, channel, quantity, max_age)
+        if reading is None:
+            error = self.get_error(device, channel, quantity, max_age)
+            if error is not None:
+                raise error
+            acquired = time.time()
+            try:
+                value = function()
+            except Exception as err:
+                self.put_error(device, channel, quantity, err, acquired)
+                raise
+            self.put(device, channel, quantity, value, acquired)
+            # not read back from the cache, which would miss it if the read took longer than max_age
+            reading = Reading(float(value), acquired)
+        return reading
+
+    def invalidate(self, device=None):
+        """
+        Forget readings, either for one device or all of them.
+        """
+        with self.lock:
+            if device is None:
+                self._readings.clear()
+                self._errors.clear()
+            else:
+                for store in (self._readings, self._errors):
+                    for key in [key for key in store if key[0] == device]:
+                        del store[key]
+
+    def snapshot(self, max_age=None):
+        """
+        Return a dictionary of all readings younger than max_age.
+        """
+        if max_age is None:
+            max_age = self.ttl
+        now = time.time()
+        with self.lock:
+            return {key: reading for key, reading in self._readings.items()
+                    if now - reading.time <= max_age}
+
+
+# the cache shared by all drivers in this process
+cache = TelemetryCache()
@@ -0,0 +1,257 @@
+# Bounded in-memory and compact on-disk storage of hardware telemetry
+from __future__ import print_function, unicode_literals, absolute_import, division
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+
+# on-disk and in-memory record format: unix time and value
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('value', '<f8')])
+
+
+class RingBuffer(object):
+    """
+    Fixed-size, NumPy-backed store of (time, value) samples for one channel.
+
+    Once full, each new sample overwrites the oldest one, so memory use is
+    fixed however long the buffer is in use. Samples must be appended in time order.
+
+    Parameters
+    ----------
+    capacity : int
+        maximum number of samples held
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=RECORD_DTYPE)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def first_time(self):
+        if self._count == 0:
+            return None
+        return self._data['time'][self._next if self._count == self.capacity else 0]
+
+    @property
+    def last_time(self):
+        if self._count == 0:
+            return None
+        return self._data['time'][self._next - 1]
+
+    def append(self, timestamp, value):
+        self._data[self._next] = (timestamp, value)
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def data(self):
+        """
+        All samples, oldest first, as a structured array with 'time' and 'value' fields.
+        """
+        if self._count < self.capacity:
+            return self._data[:self._count].copy()
+        return np.concatenate((self._data[self._next:], self._data[:self._next]))
+
+    def range(self, start=None, end=None):
+        """
+        Samples with start <= time <= end, oldest first.
+        """
+        data = self.data()
+        return data[_time_slice(data['time'], start, end)]
+
+
+def _time_slice(times, start, end):
+    """
+    Slice selecting start <= times <= end from sorted times.
+    """
+    lo = 0 if start is None else np.searchsorted(times, start, side='left')
+    hi = len(times) if end is None else np.searchsorted(times, end, side='right')
+    return slice(lo, hi)
+
+
+class TelemetryArchive(object):
+    """
+    Append-only binary archive of telemetry, one file per channel.
+
+    Each file is a flat array of little-endian (time, value) float64 pairs,
+    so it can be memory-mapped and searched by time without parsing. Samples
+    are buffered in memory and written in chunks.
+
+    Parameters
+    ----------
+    directory : str
+        directory in which to store channel files. Created if needed.
+    chunk_size : int
+        number of samples per channel buffered before writing to disk
+    """
+    def __init__(self, directory, chunk_size=64):
+        self.directory = os.path.expanduser(directory)
+        self.chunk_size = chunk_size
+        self._pending = dict()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, channel):
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', channel)
+        return os.path.join(self.directory, safe_name + '.tlm')
+
+    @property
+    def channels(self):
+        return sorted(os.path.splitext(fname)[0] for fname in os.listdir(self.directory)
+                      if fname.endswith('.tlm'))
+
+    def append(self, channel, timestamp, value):
+        pending = self._pending.setdefault(channel, [])
+        pending.append((timestamp, value))
+        if len(pending) >= self.chunk_size:
+            self.flush(channel)
+
+    def flush(self, channel=None):
+        """
+        Write buffered samples to disk, for one channel or all of them.
+        """
+        channels = list(self._pending) if channel is None else [channel]
+        for channel in channels:
+            pending = self._pending.pop(channel, [])
+            if pending:
+                with open(self.path(channel), 'ab') as fileobj:
+                    np.array(pending, dtype=RECORD_DTYPE).tofile(fileobj)
+
+    def range(self, channel, start=None, end=None):
+        """
+        Samples with start <= time <= end, oldest first.
+
+        Samples still waiting to be written are included.
+        """
+        path = self.path(channel)
+        parts = []
+        if os.path.exists(path) and os.path.getsize(path) >= RECORD_DTYPE.itemsize:
+            data = np.memmap(path, dtype=RECORD_DTYPE, mode='r',
+                             shape=(os.path.getsize(path) // RECORD_DTYPE.itemsize,))
+            parts.append(np.array(data[_time_slice(data['time'], start, end)]))
+            del data
+        pending = np.array(self._pending.get(channel, []), dtype=RECORD_DTYPE)
+        parts.append(pending[_time_slice(pending['time'], start, end)])
+        return np.concatenate(parts)
+
+
+class TelemetryStore(object):
+    """
+    History of many telemetry channels, with bounded memory use.
+
+    Recent samples of each channel are kept in a `RingBuffer`. If a directory
+    is given, every sample is also written to a `TelemetryArchive`, and queries
+    for times older than the ring buffer holds are answered from the archive.
+
+    For example::
+
+        >> store = TelemetryStore(directory='~/.hdriver/hw_archive')
+        >> store.record('ccd1_temp', -90.2)
+        >> data = store.query('ccd1_temp', start=time.time()-3600)
+        >> data['time'], data['value']
+
+    Parameters
+    ----------
+    capacity : int
+        number of samples of each channel kept in memory
+    directory : str, optional
+        directory for on-disk archive. If None, no archive is kept.
+    """
+    def __init__(self, capacity=10000, directory=None):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.buffers = dict()
+        self.archive = None if directory is None else TelemetryArchive(directory)
+
+    @property
+    def channels(self):
+        channels = set(self.buffers)
+        if self.archive is not None:
+            channels.update(self.archive.channels)
+        return sorted(channels)
+
+    def record(self, channel, value, timestamp=None):
+        """
+        Add a sample to a channel.
+
+        Samples must be added in time order; a sample no newer than the
+        last one stored for that channel is ignored.
+
+        Returns
+        -------
+        stored : bool
+            True if the sample was stored
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            buffer = self.buffers.get(channel)
+            if buffer is None:
+                buffer = self.buffers[channel] = RingBuffer(self.capacity)
+            if buffer.last_time is not None and timestamp <= buffer.last_time:
+                return False
+            buffer.append(timestamp, value)
+            if self.archive is not None:
+                self.archive.append(channel, timestamp, value)
+        return True
+
+    def record_many(self, values, timestamp=None):
+        """
+        Add samples to several channels at once.
+
+        Parameters
+        ----------
+        values : dict
+            values keyed by channel name
+        timestamp : float, optional
+            unix time of samples, defaults to now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        for channel in values:
+            self.record(channel, values[channel], timestamp)
+
+    def query(self, channel, start=None, end=None):
+        """
+        Samples of a channel with start <= time <= end, oldest first.
+
+        Returns
+        -------
+        data : `numpy.ndarray`
+            structured array with 'time' (unix time) and 'value' fields
+        """
+        with self.lock:
+            buffer = self.buffers.get(channel)
+            in_memory = buffer is not None and len(buffer) > 0
+            # use the ring buffer if there is no archive, or the buffer
+            # reaches back far enough to hold everything asked for
+            if in_memory and (self.archive is None or
+                              (start is not None and buffer.first_time <= start)):
+                return buffer.range(start, end)
+            if self.archive is not None:
+                return self.archive.range(channel, start, end)
+        return np.zeros(0, dtype=RECORD_DTYPE)
+
+    def recent(self, channel):
+        """
+        All samples of a channel held in memory, oldest first.
+        """
+        with self.lock:
+            buffer = self.buffers.get(channel)
+            if buffer is None:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            return buffer.data()
+
+    def flush(self):
+        """
+        Write any buffered archive samples to disk.
+        """
+        if self.archive is not None:
+            with self.lock:
+                self.archive.flush()
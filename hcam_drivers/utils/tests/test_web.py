@@ -0,0 +1,18 @@
+from __future__ import print_function, unicode_literals, absolute_import, division
+import numpy as np
+
+from hcam_drivers.utils.web import raw_bytes_to_numpy
+
+
+def test_raw_bytes_to_numpy():
+    raw = np.array([-32768, 0, 32767], dtype='>i2').tobytes()
+    data = raw_bytes_to_numpy(raw)
+    assert data.tolist() == [0, 32768, 65535]
+
+
+def test_raw_bytes_to_numpy_bscale():
+    raw = np.array([5, 100, 1], dtype='>i2').tobytes()
+    data = raw_bytes_to_numpy(raw, bscale=2, bzero=0)
+    assert data.tolist() == [10, 200, 2]
+    data = raw_bytes_to_numpy(raw, bscale=2, bzero=32768)
+    assert data.tolist() == [32778, 32968, 32770]
@@ -2,19 +2,41 @@
 from __future__ import print_function, unicode_literals, absolute_import, division
 import traceback
 import struct
+import fnmatch
 import os
+import re
+import time
 import json
+import mmap
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import yaml
-from tornado.web import RequestHandler
+from tornado.web import RequestHandler, HTTPError
+from tornado import gen
 from tornado.escape import json_encode
 from astropy.io import fits
 from astropy.utils.decorators import lazyproperty
+import six
 from six.moves import urllib
 
 
+# threads for blocking file access by fileservers, so the IOLoop is never blocked
+io_pool = ThreadPoolExecutor(max_workers=8)
 MSG_TEMPLATE = "MESSAGEBUFFER: {}\nRETCODE: {}"
+# number of bytes of timestamp at the end of each frame
+TIMESTAMP_BYTES = 36
+# layout of a decoded timestamp, see `decode_timestamp`
+TIMESTAMP_DTYPE = np.dtype({
+    'names': ['frameCount', 'timeStampCount', 'years', 'day_of_year',
+              'hours', 'mins', 'seconds', 'nanoseconds', 'nsats', 'synced'],
+    'formats': ['<u4']*8 + ['i1']*2,
+    'offsets': [0, 4, 8, 12, 16, 20, 24, 28, 32, 33],
+    'itemsize': TIMESTAMP_BYTES
+})
 FRAME_NUMBER_URL = 'http://localhost:5000/status/DET.FRAM2.NO'
 
 
@@ -57,9 +79,48 @@ class BaseHandler(RequestHandler):
             resp_dict['traceback'] = lines
         self.finish(json_encode(resp_dict))
 
+    @gen.coroutine
+    def list_dir(self, root, stub):
+        """
+        List runs in a directory.
+
+        By default, the names of all runs are sent, one per line. The optional
+        arguments pattern, first, last, since, order, offset and limit filter,
+        sort and page the list; see `RunIndex.list`. With format=json, the reply
+        also gives each run's number, size, mtime and number of frames, e.g::
+
+            {"total": 1200, "runs": [{"run": "run0001", "number": 1, "size": 2102400,
+                                      "mtime": 1515000000.0, "nframes": 120}, ...]}
+
+        The `RunIndex` is kept in ``self.db``, so it is shared between requests.
+        """
+        if 'index' not in self.db:
+            self.db['index'] = RunIndex(root)
+        as_json = self.get_argument('format', 'text') == 'json'
+        try:
+            options = dict(pattern=self.get_argument('pattern', None),
+                           order=self.get_argument('order', 'run'),
+                           offset=int(self.get_argument('offset', 0)),
+                           count_frames=as_json)
+            for name, kind in (('first', int), ('last', int), ('since', float), ('limit', int)):
+                value = self.get_argument(name, None)
+                options[name] = None if value is None else kind(value)
+        except ValueError:
+            raise HTTPError(400)
+        try:
+            total, runs = yield io_pool.submit(self.db['index'].list, stub, **options)
+        except ValueError:
+            raise HTTPError(400)
+        except OSError:
+            raise HTTPError(404)
+        if as_json:
+            self.write({'total': total, 'runs': runs})
+        else:
+            self.write("\n".join(entry['run'] for entry in runs))
+
 
 class FastFITSPipe:
-    def __init__(self, fileobj):
+    def __init__(self, fileobj, memmap=False):
         """
         Simple class to quickly read raw frame bytes from HiPERCAM FITS cube.
 
@@ -70,10 +131,20 @@ class FastFITSPipe:
             >> ffp.seek_frame(100)
             >> hdu_data = ffp.read_frame_bytes()
 
+        If memmap is True, frames are read from a memory map of the file, which is
+        remapped as the file grows during a run. `read_frame_view` then returns each
+        frame as a `memoryview` into the map, without copying::
+
+            >> ffp = FastFITSPipe('example.fits', memmap=True)
+            >> ffp.seek_frame(100)
+            >> data = raw_bytes_to_numpy(ffp.read_frame_view())
+
         Parameters
         -----------
         fileobj : file-like object or str
             the file-like object representing a FITS file, readonly
+        memmap : bool
+            read frames through a memory map of the file
         """
         # assume fileobj is string
         try:
@@ -82,40 +153,128 @@ class FastFITSPipe:
             self._fileobj = fileobj
         self._header_bytesize = None
         self.dtype = np.dtype('int16')
+        self.memmap = memmap
+        self._map = None
+        # (file size, number of frames) when frames were last counted
+        self._frame_count = None
+        # byte offset of the NAXIS3 card, and (size, mtime) of file when it was last read
+        self._naxis3_offset = None
+        self._naxis3_stat = None
+        # header is read with the file position, which readers in other threads share
+        self._header_lock = threading.RLock()
+
+    def close(self):
+        """
+        Close the memory map, if any, and the file.
+        """
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # views of frames still exist, map closes when they are released
+                pass
+            self._map = None
+        self._fileobj.close()
 
     @property
     def num_frames(self):
         # first, see if it's in the headers
+        size = None
         try:
             num = self.hdr['NAXIS3']
+            if num == 0:
+                # NAXIS3 is filled in when the run ends, so look for it on disk,
+                # but only if the file has changed since we last looked
+                stat = os.fstat(self._fileobj.fileno())
+                size = stat.st_size
+                if self._naxis3_stat != (stat.st_size, stat.st_mtime):
+                    num = self._final_naxis3()
+                    self._naxis3_stat = (stat.st_size, stat.st_mtime)
             if num == 0:
                 raise ValueError('run still in progress')
         except (KeyError, ValueError) as err:
+            num = self.count_frames(size)
+        return num
+
+    def _final_naxis3(self):
+        """
+        NAXIS3 as currently written in the file, read without moving the file position.
+
+        The header is searched for the NAXIS3 card once, after which only its
+        value is read. If the run has ended, so NAXIS3 is set, the cached header
+        is replaced with the final one.
+        """
+        if self._naxis3_offset is None:
+            raw = self.view_span(0, self.header_bytesize).tobytes()
+            for start in range(0, len(raw), 80):
+                if raw[start:start+8] == b'NAXIS3  ':
+                    self._naxis3_offset = start
+                    break
+            else:
+                raise KeyError('NAXIS3')
+        # fixed format value, in columns 11 to 30
+        start = self._naxis3_offset
+        num = int(self.view_span(start+10, start+30).tobytes())
+        if num:
+            # not read through the file object, whose buffer may hold the old header
+            raw = self.view_span(0, self.header_bytesize).tobytes()
+            self.hdr = fits.Header.fromstring(raw.decode('ascii'))
+        return num
+
+    def count_frames(self, size=None):
+        """
+        Number of frames in a run that is still being written, from the file size.
+
+        The count is cached against the file size, so it is only worked out again
+        when the file has grown. Usually the file size fits a whole number of frames
+        and the count takes microseconds. Only if the size is ambiguous is the
+        ESO fileserver asked for the frame number.
+
+        Parameters
+        -----------
+        size : int, optional
+            current size of file in bytes, if already known
+        """
+        if size is None:
+            size = os.fstat(self._fileobj.fileno()).st_size
+        if self._frame_count is not None and self._frame_count[0] == size:
+            return self._frame_count[1]
+        data_size = size - self.header_bytesize
+        # for some crazy reason the filesize seems to be the header size and multiple
+        # of the frame size *without the timing bytes* at times, so allow for both.
+        whole, remainder = divmod(data_size, self.framesize)
+        packed, packed_remainder = divmod(data_size, self.framesize - 36)
+        if data_size <= 0:
+            num = 0
+        elif remainder == 0 and packed_remainder != 0:
+            num = whole
+        elif packed_remainder == 0 and remainder != 0:
+            num = packed
+        else:
             # try and use ESO fileserver if it is running
             try:
                 num = getLastFrameNumber()
             except:
                 # last, desperate, chance to try to guess from the filesize
-                current_size = os.stat(self._fileobj.name).st_size
                 # cant use integer division because timestamps are buffered and 2800 fits
-                # block size causes trouble. Also, for some crazy reason the filesize
-                # from os.stat seems to be the header size and multiple of the frame
-                # size *without the timing bytes*. I don't understand this, but still...
-                data_size = current_size - self.header_bytesize
+                # block size causes trouble.
                 num = int(round(data_size / (self.framesize - 36)))
+        self._frame_count = (size, num)
         return num
 
     @lazyproperty
     def hdr(self):
-        self._fileobj.seek(0)
-        return fits.Header.fromfile(self._fileobj)
+        with self._header_lock:
+            self._fileobj.seek(0)
+            return fits.Header.fromfile(self._fileobj)
 
     @property
     def header_bytesize(self):
         if self._header_bytesize is None:
-            self._fileobj.seek(0)
-            _ = fits.Header.fromfile(self._fileobj)
-            self._header_bytesize = self._fileobj.tell()
+            with self._header_lock:
+                self._fileobj.seek(0)
+                _ = fits.Header.fromfile(self._fileobj)
+                self._header_bytesize = self._fileobj.tell()
         return self._header_bytesize
 
     @lazyproperty
@@ -138,7 +297,158 @@ class FastFITSPipe:
         """
         self._fileobj.seek(self.header_bytesize + self.framesize*(frame_number-1))
 
+    def _mapped(self, end):
+        """
+        Memory map of the file, covering at least the first end bytes.
+
+        The file is remapped if it has grown since it was last mapped.
+
+        Raises EOFError if the file is shorter than end bytes.
+        """
+        if self._map is None or len(self._map) < end:
+            size = os.fstat(self._fileobj.fileno()).st_size
+            if size < end:
+                raise EOFError('frame not written yet')
+            # old map is not closed, in case views into it are still in use
+            self._map = mmap.mmap(self._fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def frame_position(self, frame_number):
+        """
+        Byte offset of the start of a frame, starting at 1
+        """
+        return self.header_bytesize + self.framesize*(frame_number-1)
+
+    def _map_view(self, end):
+        """
+        A `memoryview` of the memory map, covering at least the first end bytes.
+        """
+        # via numpy, as the mmap of python 2 does not support memoryview
+        return memoryview(np.frombuffer(self._mapped(end), dtype=np.uint8))
+
+    def view_span(self, start_pos, end_pos):
+        """
+        A `memoryview` of part of the memory-mapped file, without copying.
+
+        Does not use or change the file position, so may be called by many
+        readers of a shared pipe.
+
+        Raises EOFError if the file is shorter than end_pos.
+        """
+        return self._map_view(end_pos)[start_pos:end_pos]
+
+    def read_frame_view(self):
+        """
+        Read the next frame as a `memoryview` of the memory-mapped file, without copying.
+
+        Works whether or not the pipe was opened with memmap=True.
+        """
+        start_pos = self._fileobj.tell()
+        end_pos = start_pos + self.framesize
+        view = self.view_span(start_pos, end_pos)
+        self._fileobj.seek(end_pos)
+        return view
+
+    @property
+    def frames_written(self):
+        """
+        Number of frames completely written to disk so far.
+        """
+        size = os.fstat(self._fileobj.fileno()).st_size
+        return max(0, (size - self.header_bytesize) // self.framesize)
+
+    def read_frames_bytes(self, start, count, stride=1):
+        """
+        Read up to count frames, starting at frame start and taking every stride'th frame.
+
+        Frames are sliced from a memory map of the file, so a run of consecutive
+        frames (stride=1) is read as one contiguous span. Only completely written
+        frames are returned, so there may be fewer than count. Afterwards the file
+        is positioned after the last frame read, ready for `read_frame_bytes`.
+
+        For example::
+
+            >> nframes, raw_bytes = ffp.read_frames_bytes(1, 100)
+            >> frames = [raw_bytes[i*ffp.framesize:(i+1)*ffp.framesize] for i in range(nframes)]
+
+        Parameters
+        -----------
+        start : int
+            first frame to read, starting at 1
+        count : int
+            maximum number of frames to read
+        stride : int, default=1
+            step between frames read
+
+        Returns
+        --------
+        nframes : int
+            number of frames read
+        raw_bytes : bytes
+            frames, one after another
+
+        Raises EOFError if frame start has not been written yet.
+        """
+        nframes, raw_bytes, end_pos = self.frames_span(start, count, stride)
+        self._fileobj.seek(end_pos)
+        return nframes, raw_bytes
+
+    def frames_span(self, start, count, stride=1):
+        """
+        As `read_frames_bytes`, but leaves the file position alone.
+
+        Returns
+        --------
+        nframes : int
+            number of frames read
+        raw_bytes : bytes
+            frames, one after another
+        end_pos : int
+            byte offset just after last frame read
+        """
+        if start < 1 or count < 1 or stride < 1:
+            raise ValueError('start, count and stride must be positive')
+        written = self.frames_written
+        if start > written:
+            raise EOFError('frame not written yet')
+        nframes = min(count, (written - start) // stride + 1)
+        first_pos = self.frame_position(start)
+        end_pos = first_pos + self.framesize*(stride*(nframes-1) + 1)
+        if stride == 1:
+            raw_bytes = self.view_span(first_pos, end_pos).tobytes()
+        else:
+            view = self._map_view(end_pos)
+            raw_bytes = b''.join(view[pos:pos+self.framesize].tobytes()
+                                 for pos in range(first_pos, end_pos, stride*self.framesize))
+        return nframes, raw_bytes, end_pos
+
+    def timestamp_bytes(self, start=1, count=None):
+        """
+        Timestamps of many frames, as an N x 36 array of bytes.
+
+        The array is a strided view of the memory-mapped file, so nothing is
+        copied until the timestamps are decoded with `decode_timestamps`::
+
+            >> times = decode_timestamps(ffp.timestamp_bytes(), mjd=True)
+
+        Parameters
+        -----------
+        start : int, default=1
+            first frame
+        count : int, optional
+            maximum number of frames. Defaults to all frames written so far.
+        """
+        written = self.frames_written
+        count = written - start + 1 if count is None else min(count, written - start + 1)
+        count = max(count, 0)
+        first_pos = self.frame_position(start)
+        frames = np.frombuffer(self._mapped(first_pos + count*self.framesize), dtype=np.uint8,
+                               count=count*self.framesize, offset=first_pos)
+        return frames.reshape(count, self.framesize)[:, -TIMESTAMP_BYTES:]
+
     def read_frame_bytes(self):
+        if self.memmap:
+            return self.read_frame_view().tobytes()
         start_pos = self._fileobj.tell()
         raw_bytes = self._fileobj.read(self.framesize)
         if len(raw_bytes) != self.framesize:
@@ -148,6 +458,269 @@ class FastFITSPipe:
         return raw_bytes
 
 
+class RunIndex(object):
+    """
+    Index of the runs in a directory tree, for fast directory listings.
+
+    Each directory is listed once, then only again when its mtime or size
+    changes, i.e when files are added or removed. Runs deleted while being
+    indexed are left out. The size and mtime of every run are checked again
+    on each listing, which only needs a stat of each file, so runs still
+    being written are always up to date. Frame counts need the header of a
+    run to be read, so are only found for runs in the page of results asked
+    for, and cached until the size changes.
+
+    For example::
+
+        >> index = RunIndex('/data')
+        >> total, runs = index.list('2018-01-01', pattern='run00*', order='-mtime', limit=20)
+        >> runs[0]
+        {'run': 'run0012', 'number': 12, 'size': 2102400, 'mtime': 1515000000.0, 'nframes': 120}
+
+    Parameters
+    ----------
+    root : str
+        top level directory served
+    """
+    ORDERS = ('run', 'mtime', 'size')
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        # directory -> dict(signature=directory (mtime, size), runs=dict(name -> entry))
+        self._dirs = dict()
+        # path -> (header_bytesize, framesize), and size when frames last counted
+        self._geometry = dict()
+        self._counted = dict()
+
+    def _entry(self, name):
+        match = re.search(r'(\d+)$', name)
+        return dict(run=name, number=int(match.group(1)) if match else None, nframes=None)
+
+    def _stat(self, directory, entry):
+        """
+        Update the size and mtime of a run. Returns False if it no longer exists.
+        """
+        try:
+            stat = os.stat(os.path.join(directory, entry['run'] + '.fits'))
+        except OSError:
+            return False
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime
+        return True
+
+    def _runs(self, directory):
+        state = self._dirs.get(directory)
+        dir_stat = os.stat(directory)
+        signature = (dir_stat.st_mtime, dir_stat.st_size)
+        if state is None or state['signature'] != signature:
+            old_runs = state['runs'] if state is not None else dict()
+            names = [os.path.splitext(fname)[0] for fname in os.listdir(directory)
+                     if fname.endswith('.fits')]
+            runs = dict()
+            for name in names:
+                runs[name] = old_runs[name] if name in old_runs else self._entry(name)
+            state = self._dirs[directory] = dict(signature=signature, runs=runs)
+        for name, entry in list(state['runs'].items()):
+            if not self._stat(directory, entry):
+                del state['runs'][name]
+        return state['runs']
+
+    def _count_frames(self, directory, entry):
+        path = os.path.join(directory, entry['run'] + '.fits')
+        if self._counted.get(path) == entry['size']:
+            return
+        if path not in self._geometry:
+            try:
+                pipe = FastFITSPipe(path)
+                try:
+                    self._geometry[path] = (pipe.header_bytesize, pipe.framesize)
+                finally:
+                    pipe.close()
+            except Exception:
+                # not a HiPERCAM run, or header not written yet
+                return
+        header_bytesize, framesize = self._geometry[path]
+        entry['nframes'] = max(0, (entry['size'] - header_bytesize) // framesize)
+        self._counted[path] = entry['size']
+
+    def list(self, stub='', pattern=None, first=None, last=None, since=None,
+             order='run', offset=0, limit=None, count_frames=True):
+        """
+        List runs in a directory.
+
+        Parameters
+        ----------
+        stub : str
+            directory, relative to root
+        pattern : str, optional
+            only include runs whose names match this shell-style pattern
+        first, last : int, optional
+            only include runs numbered from first to last
+        since : float, optional
+            only include runs modified since this unix time
+        order : str, default='run'
+            sort by 'run' number, 'mtime' or 'size'. Prefix with '-' to reverse.
+        offset : int, default=0
+            number of matching runs to skip
+        limit : int, optional
+            maximum number of runs to return
+        count_frames : bool, default=True
+            find frame counts of the runs returned
+
+        Returns
+        -------
+        total : int
+            number of runs matching
+        runs : list
+            dicts describing runs, with keys run, number, size, mtime and nframes
+        """
+        key = order.lstrip('-')
+        if key not in self.ORDERS:
+            raise ValueError('unknown order {}, use one of {}'.format(order, self.ORDERS))
+        directory = os.path.abspath(os.path.join(self.root, stub))
+        with self.lock:
+            runs = list(self._runs(directory).values())
+            if pattern is not None:
+                runs = [entry for entry in runs if fnmatch.fnmatch(entry['run'], pattern)]
+            if first is not None:
+                runs = [entry for entry in runs if entry['number'] is not None and entry['number'] >= first]
+            if last is not None:
+                runs = [entry for entry in runs if entry['number'] is not None and entry['number'] <= last]
+            if since is not None:
+                runs = [entry for entry in runs if entry['mtime'] >= since]
+            if key == 'run':
+                runs.sort(key=lambda entry: (entry['number'] is None, entry['number'], entry['run']))
+            else:
+                runs.sort(key=lambda entry: entry[key])
+            if order.startswith('-'):
+                runs.reverse()
+            total = len(runs)
+            runs = runs[offset:None if limit is None else offset + limit]
+            if count_frames:
+                for entry in runs:
+                    self._count_frames(directory, entry)
+            return total, [dict(entry) for entry in runs]
+
+
+class RunCursor(object):
+    """
+    One reader's position in a `FastFITSPipe` shared with other readers.
+
+    Has the same frame reading methods as `FastFITSPipe`, but keeps its own
+    position rather than using the shared file position, so many cursors can
+    read the same pipe independently. Other attributes, such as ``hdr`` and
+    ``framesize``, are those of the shared pipe.
+
+    Parameters
+    -----------
+    pipe : `FastFITSPipe`
+        the shared pipe
+    """
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.position = None
+
+    def __getattr__(self, name):
+        return getattr(self.pipe, name)
+
+    def _position(self):
+        if self.position is None:
+            self.position = self.pipe.header_bytesize
+        return self.position
+
+    def seek_frame(self, frame_number):
+        self.position = self.pipe.frame_position(frame_number)
+
+    def read_frame_view(self):
+        start_pos = self._position()
+        view = self.pipe.view_span(start_pos, start_pos + self.pipe.framesize)
+        self.position = start_pos + self.pipe.framesize
+        return view
+
+    def read_frame_bytes(self):
+        return self.read_frame_view().tobytes()
+
+    def read_frames_bytes(self, start, count, stride=1):
+        nframes, raw_bytes, self.position = self.pipe.frames_span(start, count, stride)
+        return nframes, raw_bytes
+
+
+class RunCache(object):
+    """
+    Reference-counted cache of open runs, shared by all clients of a fileserver.
+
+    Each run is opened once as a memory-mapped `FastFITSPipe`, and its header
+    and frame size parsed once. Clients `acquire` a `RunCursor` into the run
+    and `release` it when done. Runs no client is using are kept open in case
+    they are needed again, up to max_idle of them; beyond that the least
+    recently used are closed.
+
+    For example::
+
+        >> cursor = run_cache.acquire('/data/run0001.fits')
+        >> cursor.seek_frame(10)
+        >> raw_bytes = cursor.read_frame_bytes()
+        >> run_cache.release('/data/run0001.fits')
+
+    Parameters
+    -----------
+    max_idle : int
+        maximum number of runs kept open with no clients
+    """
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        # path -> [pipe, number of clients], least recently used first
+        self._runs = OrderedDict()
+
+    def __len__(self):
+        return len(self._runs)
+
+    def acquire(self, path):
+        """
+        Return a new `RunCursor` for the run at path, opening it if needed.
+
+        Raises IOError if the run cannot be opened.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self._runs.pop(path, None)
+            if entry is None:
+                pipe = FastFITSPipe(open(path, 'rb'), memmap=True)
+                try:
+                    # parse header once, for all clients
+                    pipe.framesize
+                except Exception:
+                    # header not complete yet, parse it later
+                    pass
+                entry = [pipe, 0]
+            entry[1] += 1
+            self._runs[path] = entry
+            return RunCursor(entry[0])
+
+    def release(self, path):
+        """
+        Finish with a run returned by `acquire`.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self._runs.get(path)
+            if entry is not None:
+                entry[1] = max(0, entry[1] - 1)
+            self._evict()
+
+    def _evict(self):
+        idle = [path for path, (pipe, nclients) in self._runs.items() if nclients == 0]
+        for path in idle[:max(0, len(idle) - self.max_idle)]:
+            pipe, _ = self._runs.pop(path)
+            pipe.close()
+
+
+# the cache shared by all handlers in this process
+run_cache = RunCache()
+
+
 def raw_bytes_to_numpy(raw_data, bscale=1, bzero=32768, dtype='int16'):
     """
     Convert output from FastFITSPipe to numpy array
@@ -160,8 +733,8 @@ def raw_bytes_to_numpy(raw_data, bscale=1, bzero=32768, dtype='int16'):
 
     Parameters
     -----------
-    raw_data : bytes
-        bytes returned from FastFITSPipe
+    raw_data : bytes, memoryview
+        bytes or view returned from FastFITSPipe
     bscale : int, default = 1
         scaling to apply to raw data.
         FITS cannot stored unsigned 16-bit integers, so
@@ -171,15 +744,280 @@ def raw_bytes_to_numpy(raw_data, bscale=1, bzero=32768, dtype='int16'):
     dtype : string, default='int16'
         data type used to store data
     """
-    data = np.fromstring(raw_data, np.dtype(dtype))
-    data.dtype = data.dtype.newbyteorder('>')
-    np.multiply(data, bscale, data)
-    # now try and recast back to unsigned ints without a copy
-    # see stackoverflow.com/questions/4389517/in-place-type-conversion-of-a-numpy-array
-    view = data.view('uint16')
-    view.dtype = view.dtype.newbyteorder('>')
-    view += bzero
-    return view
+    # a read-only view of raw_data, no copy is made
+    data = np.frombuffer(raw_data, np.dtype(dtype).newbyteorder('>'))
+    unsigned = np.dtype('uint16').newbyteorder('>')
+    if bscale != 1:
+        # scaling needs a writable copy, which is in native byte order
+        data = data.astype(dtype)
+        data *= bscale
+        unsigned = np.dtype('uint16')
+    # adding the offset as unsigned ints wraps around correctly, and makes the only copy
+    return data.view(unsigned) + np.uint16(bzero)
+
+
+CCD_NAMES = ('1', '2', '3', '4', '5')
+QUADRANT_NAMES = ('E', 'F', 'G', 'H')
+
+
+# prescan columns and overscan rows read from each quadrant, in unbinned pixels,
+# when ESO DET INCPRSCX and ESO DET INCOVSCY are set
+PRESCAN_COLUMNS = 50
+OVERSCAN_ROWS = 8
+
+
+def window_shapes(hdr):
+    """
+    Shapes of the windows read from each quadrant, from the header of a run.
+
+    If the run includes prescan columns or overscan rows, they are part of
+    each window's shape.
+
+    Parameters
+    ----------
+    hdr : `astropy.io.fits.Header`
+        main header of run
+
+    Returns
+    --------
+    shapes : list
+        (ny, nx) of each window, in binned pixels
+    """
+    mode = hdr.get('ESO DET READ CURID', 1)
+    xbin = hdr.get('ESO DET BINX1', 1)
+    ybin = hdr.get('ESO DET BINY1', 1)
+    prescan = PRESCAN_COLUMNS // xbin if _flag(hdr.get('ESO DET INCPRSCX', False)) else 0
+    overscan = OVERSCAN_ROWS // ybin if _flag(hdr.get('ESO DET INCOVSCY', False)) else 0
+    if mode == 1:
+        # full frame, each quadrant is 1024 x 512
+        keys = []
+        shapes = [(512 // ybin, 1024 // xbin)]
+    elif mode == 4:
+        keys = ['DRWIN']
+    else:
+        keys = ['WIN1', 'WIN2'] if mode == 3 else ['WIN1']
+    if keys:
+        shapes = [(hdr['ESO DET {} NY'.format(key)] // ybin, hdr['ESO DET {} NX'.format(key)] // xbin)
+                  for key in keys]
+    return [(ny + overscan, nx + prescan) for ny, nx in shapes]
+
+
+def _flag(value):
+    # header flags may be written as FITS booleans, or as 'T'/'F' strings
+    if isinstance(value, six.string_types):
+        return value.strip().upper() in ('T', 'TRUE', '1')
+    return bool(value)
+
+
+class FrameConverter(object):
+    """
+    Converts raw frames from a run into pixel values, in buffers reused for every frame.
+
+    The timestamp at the end of each frame is left out, and BZERO applied in a
+    single pass straight into the output buffer, so converting a frame allocates
+    no new arrays. `windows` splits a converted buffer into views of the window
+    read from each quadrant of each CCD.
+
+    For example::
+
+        >> conv = FrameConverter(ffp.hdr)
+        >> out = conv.empty()
+        >> wins = conv.windows(out)
+        >> while True:
+        >>     conv.convert(ffp.read_frame_view(), out)
+        >>     ccd1_e = wins['1']['E'][0]  # updated in place
+
+    Pixels of the 5 CCDs and 4 quadrants are interleaved in each frame, so the
+    window views are strided. F, G and H quadrants are flipped so that all
+    quadrants have the orientation of E.
+
+    Parameters
+    ----------
+    hdr : `astropy.io.fits.Header`
+        main header of run
+    dtype : str or `numpy.dtype`, default='uint16'
+        type of output, 'uint16' or 'float32'
+    bscale : int, default = 1
+        scaling to apply to raw data. Must be 1 for uint16 output.
+    bzero : int, default = 32768
+        offset to apply to raw data
+    shapes : list, optional
+        (ny, nx) of each window in a quadrant. Worked out from header by default.
+    """
+    def __init__(self, hdr, dtype='uint16', bscale=1, bzero=32768, shapes=None):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.dtype('uint16'), np.dtype('float32')):
+            raise ValueError('output must be uint16 or float32, not {}'.format(self.dtype))
+        if self.dtype == np.dtype('uint16') and bscale != 1:
+            raise ValueError('bscale must be 1 for uint16 output')
+        self.bscale = bscale
+        self.bzero = bzero
+        nsamp = hdr.get('ESO DET NSAMP', 1)
+        self.npix = (hdr['ESO DET ACQ1 WIN NX'] * hdr['ESO DET ACQ1 WIN NY']) // nsamp
+        # in 16 bit ints
+        self.frame_length = self.npix + TIMESTAMP_BYTES // 2
+        self.shapes = window_shapes(hdr) if shapes is None else list(shapes)
+        nwin_pix = sum(ny*nx for ny, nx in self.shapes) * len(CCD_NAMES) * len(QUADRANT_NAMES)
+        if nwin_pix != self.npix:
+            raise ValueError('windows {} do not match {} pixels per frame'.format(
+                self.shapes, self.npix))
+
+    def empty(self, nframes=None):
+        """
+        A new buffer to hold one frame, or nframes frames.
+        """
+        shape = (self.npix,) if nframes is None else (nframes, self.npix)
+        return np.empty(shape, dtype=self.dtype)
+
+    def convert(self, raw_data, out):
+        """
+        Convert raw frames into out.
+
+        Parameters
+        -----------
+        raw_data : bytes, memoryview or `numpy.ndarray`
+            one or more frames, timestamps included, as read by `FastFITSPipe`
+        out : `numpy.ndarray`
+            buffer from `empty`, big enough for the number of frames in raw_data
+
+        Returns
+        --------
+        out : `numpy.ndarray`
+            the output buffer, or the part of it holding the frames converted
+        """
+        raw = np.frombuffer(raw_data, np.dtype('>i2')).reshape(-1, self.frame_length)
+        nframes = len(raw)
+        # leave out timestamp, without copying
+        raw = raw[:, :self.npix]
+        dest = out.reshape(-1, self.npix)[:nframes]
+        if self.dtype == np.dtype('uint16'):
+            # adding the offset as unsigned ints wraps around correctly
+            np.add(raw.view('>u2'), np.uint16(self.bzero), out=dest, casting='unsafe')
+        else:
+            np.multiply(raw, np.float32(self.bscale), out=dest)
+            np.add(dest, np.float32(self.bzero), out=dest)
+        return out if out.ndim == 1 else out[:nframes]
+
+    def windows(self, out):
+        """
+        Split a buffer from `empty` into views of each window.
+
+        Views share memory with out, so only need making once per buffer.
+
+        Returns
+        --------
+        windows : dict
+            windows[ccd][quadrant] is a list of 2D arrays, one per window, e.g.
+            windows['1']['E'][0]. For a buffer of many frames, each array has
+            an extra first axis for frame number.
+        """
+        data = out.reshape(-1, self.npix)
+        nquad = len(CCD_NAMES) * len(QUADRANT_NAMES)
+        flips = {'E': (slice(None), slice(None)), 'F': (slice(None), slice(None, None, -1)),
+                 'G': (slice(None, None, -1), slice(None, None, -1)),
+                 'H': (slice(None, None, -1), slice(None))}
+        windows = {ccd: {quad: [] for quad in QUADRANT_NAMES} for ccd in CCD_NAMES}
+        offset = 0
+        for ny, nx in self.shapes:
+            npix = ny * nx * nquad
+            # pixels of all quadrants are interleaved
+            pixels = data[:, offset:offset+npix].reshape(-1, ny, nx, nquad)
+            offset += npix
+            for iccd, ccd in enumerate(CCD_NAMES):
+                for iquad, quad in enumerate(QUADRANT_NAMES):
+                    window = pixels[(Ellipsis,) + flips[quad] + (len(QUADRANT_NAMES)*iccd + iquad,)]
+                    windows[ccd][quad].append(window[0] if out.ndim == 1 else window)
+        return windows
+
+
+class FrameProcessor(object):
+    """
+    Crops, bins and compresses frames, to send to clients on slow links.
+
+    Each frame is converted with a `FrameConverter`. Selected windows are then
+    cropped to a region and binned, and sent as the 36 timestamp bytes as written
+    in the FITS file, followed by the pixels of each window in turn as little
+    endian uint16. The `layout` gives the order and shape of the windows.
+    The whole message is then optionally compressed.
+
+    Calls to `process` for one processor must not overlap, as buffers are reused.
+
+    Parameters
+    ----------
+    hdr : `astropy.io.fits.Header`
+        main header of run
+    ccds : list, optional
+        names of CCDs to send, default all
+    region : list, optional
+        [x1, x2, y1, y2] part of each window to send, counting from 0 in pixels
+        of the window as read out. These are binned if the CCDs were read out
+        binned, but are before the extra binning applied here. Follows Python
+        slice rules, so None means no limit.
+    binning : list, default=(1, 1)
+        (xbin, ybin). Binned pixels are the mean of the pixels binned, and
+        pixels left over at the edges are dropped.
+    codec : str, optional
+        None, 'zlib', or 'delta+zlib'. 'delta+zlib' sends the difference (modulo
+        2**16) between successive pixels, which compresses much better than raw
+        pixels. Undo it with ``np.cumsum(pixels, dtype=np.uint16)``.
+    level : int, default=1
+        zlib compression level
+    """
+    CODECS = (None, 'zlib', 'delta+zlib')
+
+    def __init__(self, hdr, ccds=None, region=None, binning=(1, 1), codec=None, level=1):
+        if codec not in self.CODECS:
+            raise ValueError('unknown codec {}, use one of {}'.format(codec, self.CODECS))
+        self.converter = FrameConverter(hdr)
+        self.ccds = list(CCD_NAMES) if ccds is None else [str(ccd) for ccd in ccds]
+        for ccd in self.ccds:
+            if ccd not in CCD_NAMES:
+                raise ValueError('unknown CCD {}'.format(ccd))
+        x1, x2, y1, y2 = [None]*4 if region is None else region
+        self.region = (slice(y1, y2), slice(x1, x2))
+        self.xbin, self.ybin = binning
+        if self.xbin < 1 or self.ybin < 1:
+            raise ValueError('binning factors must be positive')
+        self.codec = codec
+        self.level = level
+        self.buffer = self.converter.empty()
+        windows = self.converter.windows(self.buffer)
+        # views of parts of buffer to send, and their shape after binning
+        self.views = []
+        self.layout = []
+        for ccd in self.ccds:
+            for quad in QUADRANT_NAMES:
+                for iwin, window in enumerate(windows[ccd][quad]):
+                    view = window[self.region]
+                    ny, nx = view.shape[0] // self.ybin, view.shape[1] // self.xbin
+                    self.views.append(view[:ny*self.ybin, :nx*self.xbin])
+                    self.layout.append(dict(ccd=ccd, quad=quad, window=iwin, ny=ny, nx=nx))
+        self.pixels = np.empty(sum(w['ny']*w['nx'] for w in self.layout), dtype='<u2')
+
+    def process(self, raw_data):
+        """
+        Turn one raw frame, timestamp included, into bytes to send.
+        """
+        self.converter.convert(raw_data, self.buffer)
+        offset = 0
+        for view, window in zip(self.views, self.layout):
+            ny, nx = window['ny'], window['nx']
+            dest = self.pixels[offset:offset+ny*nx].reshape(ny, nx)
+            if self.xbin == 1 and self.ybin == 1:
+                dest[...] = view
+            else:
+                binned = view.reshape(ny, self.ybin, nx, self.xbin).sum(axis=(1, 3), dtype=np.uint32)
+                dest[...] = binned // (self.xbin * self.ybin)
+            offset += ny*nx
+        pixels = self.pixels
+        if self.codec == 'delta+zlib':
+            # uint16 arithmetic wraps around, so this is lossless
+            pixels = np.diff(pixels, prepend=np.uint16(0)).astype('<u2')
+        timestamp = memoryview(raw_data)[-TIMESTAMP_BYTES:].tobytes()
+        message = timestamp + pixels.tobytes()
+        if self.codec is not None:
+            message = zlib.compress(message, self.level)
+        return message
 
 
 def decode_timestamp(ts_bytes):
@@ -233,3 +1071,50 @@ def decode_timestamp(ts_bytes):
     """
     buf = struct.pack('<' + 'H'*18, *(val + 32768 for val in struct.unpack('>'+'h'*18, ts_bytes)))
     return struct.unpack('<' + 'I'*8, buf[:-4]) + struct.unpack('bb', buf[-4:-2])
+
+
+def decode_timestamps(ts_bytes, mjd=False):
+    """
+    Decode the timestamps of many frames at once.
+
+    Reverses the same mangling as `decode_timestamp`, but with array operations
+    on all timestamps together, so that timestamps of a whole run can be decoded
+    in a fraction of a second::
+
+        >> ts_bytes = ffp.timestamp_bytes()
+        >> times = decode_timestamps(ts_bytes)
+        >> times['frameCount'], times['nsats']
+
+    Parameters
+    ----------
+    ts_bytes: bytes or `numpy.ndarray`
+        timestamps as written in the FITS file. Either 36*N bytes, or an N x 36
+        array of bytes, such as that returned by `FastFITSPipe.timestamp_bytes`,
+        which may be a strided view.
+    mjd : bool, default=False
+        if True, also return the MJD (UTC) of each timestamp
+
+    Returns
+    --------
+    timestamps : `numpy.ndarray`
+        structured array of length N with fields (frameCount, timeStampCount,
+        years, day_of_year, hours, mins, seconds, nanoseconds, nsats, synced)
+    mjds : `numpy.ndarray`
+        MJD of each timestamp, only returned if mjd is True
+    """
+    if isinstance(ts_bytes, np.ndarray):
+        raw = ts_bytes.reshape(-1, TIMESTAMP_BYTES)
+    else:
+        raw = np.frombuffer(ts_bytes, dtype=np.uint8).reshape(-1, TIMESTAMP_BYTES)
+    # big endian signed 16bit ints -> add 32768 -> little endian unsigned 16bit ints
+    values = np.ascontiguousarray(raw).view('>u2') + np.uint16(32768)
+    timestamps = values.astype('<u2').view(TIMESTAMP_DTYPE)[:, 0]
+    if not mjd:
+        return timestamps
+    # MJD of 1st January of each year, from days since 1970
+    years = (timestamps['years'].astype(np.int64) - 1970).astype('datetime64[Y]')
+    mjds = years.astype('datetime64[D]').astype(np.float64) + 40587.0
+    seconds = (3600.0*timestamps['hours'] + 60.0*timestamps['mins'] +
+               timestamps['seconds'] + 1.0e-9*timestamps['nanoseconds'])
+    mjds += timestamps['day_of_year'] - 1.0 + seconds / 86400.0
+    return timestamps, mjds